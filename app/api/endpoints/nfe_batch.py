@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-import hashlib
 from fastapi import APIRouter, Request
+from starlette.concurrency import run_in_threadpool
 
 from app.services.audit_log import append_audit_event
 from app.services.nfe_batch import parse_nfe_zip_batch_summary
@@ -18,11 +18,14 @@ async def nfe_xml_batch_summary(request: Request):
     raw = await request.body()
     filename = request.headers.get("x-filename", "upload.zip")
 
-    result = parse_nfe_zip_batch_summary(raw, filename=filename)
+    # Parse do lote é CPU-bound: roda fora do event loop, que segue
+    # recebendo outros uploads enquanto isso
+    result = await run_in_threadpool(parse_nfe_zip_batch_summary, raw, filename=filename)
 
     # Auditoria leve: 1 evento por batch + (opcional) 1 por arquivo OK/erro
     try:
-        zip_sha256 = hashlib.sha256(raw).hexdigest()
+        # Hash já calculado pelo serviço de lote
+        zip_sha256 = result.get("sha256_zip")
 
         append_audit_event(
             {
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Request, Response
+from starlette.concurrency import run_in_threadpool
 import hashlib
+import io
 
 from app.services.nfe_batch_export import export_nfe_zip_batch_to_csv
 from app.services.audit_log import append_audit_event
@@ -28,13 +30,18 @@ async def nfe_xml_batch_export_csv(request: Request):
     except Exception:
         pass
 
-    csv_text = export_nfe_zip_batch_to_csv(zip_bytes)
+    # CSV gravado já em UTF-8 (sem string intermediária para codificar depois)
+    buf = io.BytesIO()
+    text = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+    # Processamento do lote fora do event loop (CPU-bound)
+    await run_in_threadpool(export_nfe_zip_batch_to_csv, zip_bytes, out=text)
+    text.flush()
 
     out_name = filename.rsplit(".", 1)[0] + "_itens.csv"
     headers = {"Content-Disposition": f'attachment; filename="{out_name}"'}
 
     return Response(
-        content=csv_text,
+        content=buf.getvalue(),
         media_type="text/csv; charset=utf-8",
         headers=headers,
     )
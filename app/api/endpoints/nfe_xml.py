@@ -9,7 +9,7 @@ Endpoints:
 """
 from __future__ import annotations
 
-import hashlib
+import io
 import logging
 
 from fastapi import APIRouter, Request, Response, UploadFile, File, HTTPException
@@ -81,7 +81,8 @@ async def nfe_xml_extract(request: Request, page: int = 1, page_size: int = 50):
     
     # 4) Auditoria
     try:
-        xml_sha256 = hashlib.sha256(raw).hexdigest()
+        # Hash já calculado no parse
+        xml_sha256 = result.get("sha256")
         
         append_audit_event({
             "kind": "nfe_xml_extract_page",
@@ -191,7 +192,7 @@ async def nfe_xml_extract_summary(file: UploadFile = File(...)):
     
     # Auditoria
     try:
-        xml_sha256 = hashlib.sha256(raw).hexdigest()
+        xml_sha256 = result.sha256
         append_audit_event({
             "kind": "nfe_xml_extract_summary",
             "filename": filename,
@@ -244,7 +245,8 @@ async def nfe_xml_export_csv(request: Request):
     raw = await request.body()
     filename = request.headers.get("x-filename", "upload.xml")
     
-    result = parse_nfe_xml(xml_bytes=raw, filename=filename)
+    # CSV não tem coluna de origem dos campos
+    result = parse_nfe_xml(xml_bytes=raw, filename=filename, include_field_sources=False)
     
     if not result.received:
         return {
@@ -262,12 +264,17 @@ async def nfe_xml_export_csv(request: Request):
     except Exception as exc:
         logger.warning(f"Falha na normalização para CSV: {exc}", exc_info=True)
     
-    csv_text = export_nfe_items_to_csv(items_for_csv)
+    # CSV gravado já em UTF-8 (sem string intermediária para codificar depois)
+    buf = io.BytesIO()
+    text = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+    export_nfe_items_to_csv(items_for_csv, out=text)
+    text.flush()
+    csv_bytes = buf.getvalue()
     out_name = filename.rsplit(".", 1)[0] + ".csv"
     
     # Auditoria
     try:
-        xml_sha256 = hashlib.sha256(raw).hexdigest()
+        xml_sha256 = result.sha256
         append_audit_event({
             "kind": "nfe_xml_export_csv",
             "filename": filename,
@@ -280,4 +287,4 @@ async def nfe_xml_export_csv(request: Request):
         logger.warning(f"Falha na auditoria: {exc}", exc_info=True)
     
     headers = {"Content-Disposition": f'attachment; filename="{out_name}"'}
-    return Response(content=csv_text, media_type="text/csv; charset=utf-8", headers=headers)
+    return Response(content=csv_bytes, media_type="text/csv; charset=utf-8", headers=headers)
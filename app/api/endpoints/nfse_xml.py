@@ -8,9 +8,13 @@ Endpoints disponíveis:
 - POST /nfse-xml-extract/multi - Extrai MÚLTIPLAS notas individuais de um XML
 - POST /nfse-xml-extract/export-csv - Exporta para CSV
 - POST /nfse-xml-batch/summary - Processa ZIP com múltiplos XMLs
+- POST /nfse-xml-batch/stream - Processa ZIP, resultados em NDJSON (streaming)
 """
 from fastapi import APIRouter, Request, Response, File, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import hashlib
+import json
 import logging
 
 from app.services.audit_log import append_audit_event
@@ -22,7 +26,7 @@ from app.services.nfse_xml_extract import (
 )
 from app.services.nfse_service_normalizer import normalize_nfse_items, normalize_nfse_item
 from app.services.nfse_document_analyzer import analyze_nfse_document
-from app.services.nfse_batch import parse_nfse_zip_batch_summary
+from app.services.nfse_batch import iter_nfse_zip_batch, parse_nfse_zip_batch_summary
 
 logger = logging.getLogger(__name__)
 
@@ -309,7 +313,9 @@ async def nfse_xml_batch_summary(file: UploadFile = File(...)):
     raw = await file.read()
     filename = file.filename or "upload.zip"
     
-    result = parse_nfse_zip_batch_summary(zip_bytes=raw, filename=filename)
+    # Parse do lote é CPU-bound: roda fora do event loop, que segue
+    # recebendo outros uploads enquanto isso
+    result = await run_in_threadpool(parse_nfse_zip_batch_summary, zip_bytes=raw, filename=filename)
     
     # Auditoria
     try:
@@ -327,3 +333,45 @@ async def nfse_xml_batch_summary(file: UploadFile = File(...)):
         pass
     
     return result
+
+
+@router.post("/nfse-xml-batch/stream")
+async def nfse_xml_batch_stream(file: UploadFile = File(...)):
+    """
+    Processa ZIP com múltiplos XMLs de NFS-e, em streaming.
+    
+    Retorna NDJSON, uma linha {"type": ..., "data": ...} por evento:
+        - batch: received, filename, sha256_zip
+        - file / error: um por arquivo, na ordem do ZIP
+        - batch_summary: agregações do lote (última linha)
+    
+    Mesmo conteúdo de /nfse-xml-batch/summary, sem montar a resposta inteira
+    em memória.
+    """
+    raw = await file.read()
+    filename = file.filename or "upload.zip"
+    
+    def _lines():
+        batch = {}
+        for kind, payload in iter_nfse_zip_batch(zip_bytes=raw, filename=filename):
+            if kind == "batch":
+                batch = payload
+            elif kind == "batch_summary":
+                # Auditoria (lote já processado)
+                try:
+                    append_audit_event(
+                        {
+                            "kind": "nfse_xml_batch_stream",
+                            "filename": filename,
+                            "sha256_zip": batch.get("sha256_zip"),
+                            "count_files_ok": payload.get("count_files_ok", 0),
+                            "count_files_error": payload.get("count_files_error", 0),
+                            "batch_summary": payload,
+                        }
+                    )
+                except Exception:
+                    pass
+            yield json.dumps({"type": kind, "data": payload}, ensure_ascii=False, default=str) + "\n"
+    
+    # Gerador síncrono: o Starlette itera em threadpool (fora do event loop)
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
@@ -2,12 +2,16 @@ from __future__ import annotations
 
 import hashlib
 import io
+import math
+import os
 import zipfile
-from typing import Any, Dict, List
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 
-from app.services.nfe_xml_extract import parse_nfe_xml
+from app.services.nfe_xml_extract import NFeExtractResult, parse_nfe_xml
 from app.services.nfe_item_normalizer import normalize_nfe_items
 from app.services.nfe_document_analyzer import analyze_nfe_document
+from app.utils.process_pool import map_in_pool
 
 
 def _sha256(data: bytes) -> str:
@@ -19,6 +23,125 @@ def _is_xml_name(name: str) -> bool:
     return n.endswith(".xml")
 
 
+@dataclass(frozen=True)
+class NFeZipEntry:
+    """Resultado de parse + normalização de um XML dentro do ZIP."""
+    name: str
+    xml_sha256: Optional[str] = None
+    parsed: Optional[NFeExtractResult] = None
+    enriched_items: List[Dict[str, Any]] = field(default_factory=list)
+    norm_summary: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[Dict[str, Any]] = None
+
+
+# A partir de quantos XMLs o lote é processado em paralelo (pool de processos;
+# parse e normalização são CPU-bound e seguram o GIL)
+_PARALLEL_MIN_FILES = 8
+
+
+def _process_xml(name: str, xml_bytes: bytes) -> NFeZipEntry:
+    """Parse + normalização de um XML do lote (top-level para rodar em outro processo)."""
+    try:
+        # Parse 1 NF-e (hash calculado uma vez e reaproveitado)
+        xml_sha256 = _sha256(xml_bytes)
+        parsed = parse_nfe_xml(xml_bytes=xml_bytes, filename=name, sha256=xml_sha256)
+        if not getattr(parsed, "received", False):
+            return NFeZipEntry(name=name, parsed=parsed, error={
+                "file": name,
+                "error": "parse_failed",
+                "details": getattr(parsed, "error", None)
+            })
+
+        # Normaliza itens (rows recém-extraídas: mescla no lugar, sem cópia)
+        enriched_items, norm_summary = normalize_nfe_items(parsed.items, copy=False)
+
+        return NFeZipEntry(
+            name=name,
+            xml_sha256=xml_sha256,
+            parsed=parsed,
+            enriched_items=enriched_items,
+            norm_summary=norm_summary,
+        )
+
+    except Exception as exc:
+        return NFeZipEntry(name=name, error={
+            "file": name,
+            "error": "exception",
+            "exception": str(exc)
+        })
+
+
+def load_nfe_zip_entries(
+    zip_bytes: bytes,
+    *,
+    max_files: int = 200,
+    max_total_bytes: int = 50 * 1024 * 1024,
+) -> List[NFeZipEntry]:
+    """
+    Abre o ZIP uma única vez e faz parse + normalização de cada XML.
+
+    Usado pelo summary e pelo export-csv. Lotes com _PARALLEL_MIN_FILES ou
+    mais XMLs (e mais de um CPU) são processados num pool de processos; a
+    ordem das entradas é preservada.
+
+    Raises:
+        zipfile.BadZipFile (ou similar) se o ZIP for inválido.
+    """
+    # Posição já ocupada por erro de leitura/limite, ou None (XML a processar)
+    entries: List[Optional[NFeZipEntry]] = []
+    pending_idx: List[int] = []
+    pending_names: List[str] = []
+    pending_xmls: List[bytes] = []
+
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        # lista de candidatos
+        names = [n for n in zf.namelist() if _is_xml_name(n) and not n.endswith("/")]
+        names = [n for n in names if "__MACOSX" not in n]
+
+        if len(names) > max_files:
+            names = names[:max_files]
+
+        # controle de volume descompactado
+        decompressed_total = 0
+
+        for name in names:
+            try:
+                xml_bytes = zf.read(name)
+            except Exception as exc:
+                entries.append(NFeZipEntry(name=name, error={
+                    "file": name,
+                    "error": "exception",
+                    "exception": str(exc)
+                }))
+                continue
+
+            decompressed_total += len(xml_bytes)
+            if decompressed_total > max_total_bytes:
+                entries.append(NFeZipEntry(name=name, error={
+                    "file": name,
+                    "error": "Batch decompressed size exceeded limit",
+                    "limit_bytes": max_total_bytes
+                }))
+                break
+
+            pending_idx.append(len(entries))
+            pending_names.append(name)
+            pending_xmls.append(xml_bytes)
+            entries.append(None)
+
+    results = None
+    if len(pending_xmls) >= _PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
+        # None: pool indisponível ou quebrado (já registrado em log)
+        results = map_in_pool(_process_xml, pending_names, pending_xmls)
+    if results is None:
+        results = [_process_xml(n, x) for n, x in zip(pending_names, pending_xmls)]
+
+    for idx, entry in zip(pending_idx, results):
+        entries[idx] = entry
+
+    return entries
+
+
 def parse_nfe_zip_batch_summary(
     zip_bytes: bytes,
     filename: str = "upload.zip",
@@ -55,8 +178,8 @@ def parse_nfe_zip_batch_summary(
 
     # agregações do lote
     total_items = 0
-    sum_vnf = 0.0
-    sum_vprod = 0.0
+    vnf_values: List[float] = []
+    vprod_values: List[float] = []
 
     sum_dec_auto = 0
     sum_dec_review = 0
@@ -66,11 +189,12 @@ def parse_nfe_zip_batch_summary(
     sum_missing_cfop = 0
     sum_item_total_invalid = 0
 
-    # controle de volume descompactado
-    decompressed_total = 0
-
     try:
-        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+        entries = load_nfe_zip_entries(
+            zip_bytes,
+            max_files=max_files,
+            max_total_bytes=max_total_bytes,
+        )
     except Exception as exc:
         return {
             "received": False,
@@ -83,11 +207,7 @@ def parse_nfe_zip_batch_summary(
             "batch_summary": {"error": "Invalid zip"},
         }
 
-    # lista de candidatos
-    names = [n for n in zf.namelist() if _is_xml_name(n) and not n.endswith("/")]
-    names = [n for n in names if "__MACOSX" not in n]
-
-    if not names:
+    if not entries:
         return {
             "received": False,
             "filename": filename,
@@ -99,34 +219,17 @@ def parse_nfe_zip_batch_summary(
             "batch_summary": {"error": "No .xml files found"},
         }
 
-    if len(names) > max_files:
-        names = names[:max_files]
+    for entry in entries:
+        if entry.error is not None:
+            errors_out.append(entry.error)
+            continue
 
-    for name in names:
-        try:
-            xml_bytes = zf.read(name)
-            decompressed_total += len(xml_bytes)
-            if decompressed_total > max_total_bytes:
-                errors_out.append({
-                    "file": name,
-                    "error": "Batch decompressed size exceeded limit",
-                    "limit_bytes": max_total_bytes
-                })
-                break
-
-            # Parse 1 NF-e
-            parsed = parse_nfe_xml(xml_bytes=xml_bytes, filename=name)
-            if not getattr(parsed, "received", False):
-                errors_out.append({
-                    "file": name,
-                    "error": "parse_failed",
-                    "details": getattr(parsed, "error", None)
-                })
-                continue
-
-            # Normaliza itens
-            enriched_items, norm_summary = normalize_nfe_items(parsed.items)
+        name = entry.name
+        parsed = entry.parsed
+        enriched_items = entry.enriched_items
+        norm_summary = entry.norm_summary
 
+        try:
             # Mescla summary
             merged_summary = {
                 **(parsed.summary or {}),
@@ -150,18 +253,13 @@ def parse_nfe_zip_batch_summary(
             # agrega lote
             total_items += int(parsed.count or 0)
 
+            # Totais já vêm como float/None do extractor (safe_float)
             vnf = parsed.totals.get("vNF")
             vprod = parsed.totals.get("vProd")
-            if vnf is not None:
-                try:
-                    sum_vnf += float(vnf)
-                except Exception:
-                    pass
-            if vprod is not None:
-                try:
-                    sum_vprod += float(vprod)
-                except Exception:
-                    pass
+            if isinstance(vnf, (int, float)):
+                vnf_values.append(vnf)
+            if isinstance(vprod, (int, float)):
+                vprod_values.append(vprod)
 
             ds = norm_summary.get("decision_summary") or {}
             qs = norm_summary.get("quality_summary") or {}
@@ -175,11 +273,11 @@ def parse_nfe_zip_batch_summary(
             sum_item_total_invalid += int(qs.get("item_total_invalid", 0) or 0)
 
             # Extrai nome do arquivo sem path
-            file_basename = name.split("/")[-1].split("\\")[-1]
+            file_basename = name.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
 
             files_out.append({
                 "file": file_basename,
-                "xml_sha256": _sha256(xml_bytes),
+                "xml_sha256": entry.xml_sha256,
                 "received": True,
                 "count_items": int(parsed.count or 0),
                 "header": parsed.header,
@@ -203,8 +301,9 @@ def parse_nfe_zip_batch_summary(
         "count_files_ok": len(files_out),
         "count_files_error": len(errors_out),
         "count_total_items": total_items,
-        "sum_vNF": round(sum_vnf, 2),
-        "sum_vProd": round(sum_vprod, 2),
+        # fsum: soma exata, sem acúmulo de erro de ponto flutuante em lotes grandes
+        "sum_vNF": round(math.fsum(vnf_values), 2),
+        "sum_vProd": round(math.fsum(vprod_values), 2),
         "decision_summary": {
             "auto": sum_dec_auto,
             "review": sum_dec_review,
@@ -48,6 +48,10 @@ REASON_DOC_CANNOT_CLASSIFY = "DOC_CANNOT_CLASSIFY"
 REASON_DOC_ITEMS_HAVE_REVIEW_HIGH = "DOC_ITEMS_HAVE_REVIEW_HIGH"
 REASON_DOC_ITEMS_HAVE_REVIEW_MEDIUM = "DOC_ITEMS_HAVE_REVIEW_MEDIUM"
 
+# Vocabulário canônico emitido pelo normalizador de itens (caminho rápido)
+_ITEM_CLASSES = frozenset((DOC_CLASS_MEDICAMENTO, DOC_CLASS_MATERIAL_HOSP, DOC_CLASS_GENERICO))
+_ITEM_REVIEW_LEVELS = frozenset((DOC_REVIEW_LOW, DOC_REVIEW_MEDIUM, DOC_REVIEW_HIGH))
+
 
 @dataclass(frozen=True)
 class DocumentThresholds:
@@ -81,8 +85,10 @@ def _summarize_top_reasons(reasons: list[str], max_items: int = 8) -> list[str]:
 
 def _normalize_doc_class(pc: str) -> str:
     """Normaliza classe de produto para comparação."""
+    if pc in _ITEM_CLASSES:
+        return pc
     p = (pc or "").strip().upper()
-    if p in (DOC_CLASS_MEDICAMENTO, DOC_CLASS_MATERIAL_HOSP, DOC_CLASS_GENERICO):
+    if p in _ITEM_CLASSES:
         return p
     return ""
 
@@ -91,6 +97,59 @@ def _normalize_doc_class(pc: str) -> str:
 # Classificação do documento
 # =============================================================================
 
+def _tally_items(
+    enriched_items: list[dict[str, Any]],
+) -> tuple[dict[str, int], int, int, int]:
+    """
+    Percorre os itens uma única vez contando classes e sinais de qualidade.
+    
+    Returns:
+        Tupla (classes_seen, itens_incompletos, itens_review_high, itens_review_medium)
+    """
+    classes_seen = {
+        DOC_CLASS_MEDICAMENTO: 0,
+        DOC_CLASS_MATERIAL_HOSP: 0,
+        DOC_CLASS_GENERICO: 0,
+        "OTHER": 0,
+        "UNKNOWN": 0,
+    }
+    count_incomplete = 0
+    review_high = 0
+    review_medium = 0
+    
+    for row in enriched_items or []:
+        if not isinstance(row, dict):
+            classes_seen["UNKNOWN"] += 1
+            continue
+        
+        # Classe do item
+        norm = row.get("normalized") or {}
+        pc_raw = norm.get("product_class") or ""
+        pc = _normalize_doc_class(pc_raw)
+        
+        if pc:
+            classes_seen[pc] += 1
+        elif pc_raw:
+            classes_seen["OTHER"] += 1
+        else:
+            classes_seen["UNKNOWN"] += 1
+        
+        # Qualidade do item
+        flags = row.get("flags") or {}
+        if isinstance(flags, dict) and flags.get("incomplete") is True:
+            count_incomplete += 1
+        
+        rl = row.get("review_level") or ""
+        if rl not in _ITEM_REVIEW_LEVELS:
+            rl = rl.strip().upper()
+        if rl == DOC_REVIEW_HIGH:
+            review_high += 1
+        elif rl == DOC_REVIEW_MEDIUM:
+            review_medium += 1
+    
+    return classes_seen, count_incomplete, review_high, review_medium
+
+
 def classify_nfe_document_from_items(
     enriched_items: list[dict[str, Any]],
     majority_threshold: float = 0.6,
@@ -115,30 +174,15 @@ def classify_nfe_document_from_items(
     Returns:
         Tupla (classe_documento, metadados)
     """
-    classes_seen = {
-        DOC_CLASS_MEDICAMENTO: 0,
-        DOC_CLASS_MATERIAL_HOSP: 0,
-        DOC_CLASS_GENERICO: 0,
-        "OTHER": 0,
-        "UNKNOWN": 0,
-    }
-    
-    for row in enriched_items or []:
-        norm = (row.get("normalized") or {}) if isinstance(row, dict) else {}
-        pc_raw = norm.get("product_class") or ""
-        pc = _normalize_doc_class(pc_raw)
-        
-        if pc == DOC_CLASS_MEDICAMENTO:
-            classes_seen[DOC_CLASS_MEDICAMENTO] += 1
-        elif pc == DOC_CLASS_MATERIAL_HOSP:
-            classes_seen[DOC_CLASS_MATERIAL_HOSP] += 1
-        elif pc == DOC_CLASS_GENERICO:
-            classes_seen[DOC_CLASS_GENERICO] += 1
-        elif pc_raw:
-            classes_seen["OTHER"] += 1
-        else:
-            classes_seen["UNKNOWN"] += 1
-    
+    classes_seen, _, _, _ = _tally_items(enriched_items)
+    return _classify_from_counts(classes_seen, majority_threshold)
+
+
+def _classify_from_counts(
+    classes_seen: dict[str, int],
+    majority_threshold: float = 0.6,
+) -> tuple[str, dict[str, Any]]:
+    """Aplica as regras de classificação sobre as contagens por classe."""
     total_items = sum(classes_seen.values())
     meta = {"classes_seen": classes_seen}
     
@@ -341,29 +385,22 @@ def analyze_nfe_document(
     if missing_header:
         reasons.append(REASON_DOC_MISSING_HEADER_KEYS)
     
+    # Varredura única dos itens (classes + qualidade)
+    (
+        classes_seen,
+        count_item_incomplete,
+        items_review_high,
+        items_review_medium,
+    ) = _tally_items(enriched_items)
+    
     # Classificação por itens
-    doc_class, class_meta = classify_nfe_document_from_items(enriched_items)
+    doc_class, class_meta = _classify_from_counts(classes_seen)
     if doc_class == DOC_CLASS_UNKNOWN:
         reasons.append(REASON_DOC_CANNOT_CLASSIFY)
     if doc_class == DOC_CLASS_MIXED:
         reasons.append(REASON_DOC_ITEMS_MIXED_CLASSES)
     
     # Qualidade dos itens
-    count_item_incomplete = 0
-    items_review_high = 0
-    items_review_medium = 0
-    
-    for row in enriched_items or []:
-        flags = row.get("flags") or {}
-        if isinstance(flags, dict) and flags.get("incomplete") is True:
-            count_item_incomplete += 1
-        
-        rl = (row.get("review_level") or "").strip().upper()
-        if rl == "HIGH":
-            items_review_high += 1
-        elif rl == "MEDIUM":
-            items_review_medium += 1
-    
     if count_item_incomplete > 0:
         reasons.append(REASON_DOC_ITEMS_HAVE_INCOMPLETE)
     if items_review_high > 0:
@@ -375,14 +412,16 @@ def analyze_nfe_document(
     diff_vprod = safe_float((summary or {}).get("diff_items_vs_total_vProd"))
     total_vprod = safe_float((totals or {}).get("vProd"))
     
-    has_total_divergence = False
-    if diff_vprod is not None and total_vprod is not None:
-        abs_ok = abs(diff_vprod) <= thresholds.vprod_abs
-        pct_ok = percent_diff(total_vprod, total_vprod + diff_vprod) <= thresholds.vprod_pct
-        
-        if (not abs_ok) and (not pct_ok):
-            has_total_divergence = True
-            reasons.append(REASON_DOC_TOTAL_DIVERGENCE)
+    # Só diverge se estourar AMBOS os limites; o percentual só é calculado
+    # quando o absoluto já foi excedido.
+    has_total_divergence = (
+        diff_vprod is not None
+        and total_vprod is not None
+        and abs(diff_vprod) > thresholds.vprod_abs
+        and percent_diff(total_vprod, total_vprod + diff_vprod) > thresholds.vprod_pct
+    )
+    if has_total_divergence:
+        reasons.append(REASON_DOC_TOTAL_DIVERGENCE)
     
     reasons = dedup_keep_order(reasons)
     
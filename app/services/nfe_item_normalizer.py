@@ -10,12 +10,13 @@ Responsável por:
 """
 from __future__ import annotations
 
+import re
+import sys
+from functools import lru_cache
 from typing import Any
 
 from app.core.config import settings
 from app.utils.converters import (
-    calculate_expected_vprod,
-    is_positive_number,
     normalize_text_or_none,
     safe_float,
     sanitize_product_code,
@@ -41,6 +42,47 @@ REASON_CLASS_MATERIAL_BY_NCM = "CLASS_MATERIAL_BY_NCM"
 REASON_CLASS_MATERIAL_BY_KEYWORD = "CLASS_MATERIAL_BY_KEYWORD"
 REASON_CLASS_GENERIC_FALLBACK = "CLASS_GENERIC_FALLBACK"
 
+# Reasons de classificação (tuplas compartilhadas, somente leitura)
+_REASONS_MED_BY_NCM = (REASON_CLASS_MED_BY_NCM,)
+_REASONS_MED_BY_KEYWORD = (REASON_CLASS_MED_BY_KEYWORD,)
+_REASONS_MATERIAL_BY_NCM = (REASON_CLASS_MATERIAL_BY_NCM,)
+_REASONS_MATERIAL_BY_KEYWORD = (REASON_CLASS_MATERIAL_BY_KEYWORD,)
+_REASONS_GENERIC_FALLBACK = (REASON_CLASS_GENERIC_FALLBACK,)
+
+# Um bit por reason: o nível de revisão vira teste de máscara
+REASON_BITS = {
+    reason: 1 << bit
+    for bit, reason in enumerate((
+        REASON_NCM_MISSING,
+        REASON_CFOP_MISSING,
+        REASON_PRODUCT_CODE_MISSING,
+        REASON_PRODUCT_DESC_MISSING,
+        REASON_QTY_OR_PRICE_MISSING,
+        REASON_TOTAL_ITEM_INVALID,
+        REASON_CLASS_MED_BY_NCM,
+        REASON_CLASS_MED_BY_KEYWORD,
+        REASON_CLASS_MATERIAL_BY_NCM,
+        REASON_CLASS_MATERIAL_BY_KEYWORD,
+        REASON_CLASS_GENERIC_FALLBACK,
+    ))
+}
+
+_NCM_MISSING_BIT = REASON_BITS[REASON_NCM_MISSING]
+_CFOP_MISSING_BIT = REASON_BITS[REASON_CFOP_MISSING]
+_TOTAL_INVALID_BIT = REASON_BITS[REASON_TOTAL_ITEM_INVALID]
+
+# Reasons que determinam o nível de revisão
+_HIGH_MASK = (
+    REASON_BITS[REASON_PRODUCT_CODE_MISSING]
+    | REASON_BITS[REASON_PRODUCT_DESC_MISSING]
+    | REASON_BITS[REASON_NCM_MISSING]
+    | REASON_BITS[REASON_CFOP_MISSING]
+)
+_MEDIUM_MASK = (
+    REASON_BITS[REASON_TOTAL_ITEM_INVALID]
+    | REASON_BITS[REASON_QTY_OR_PRICE_MISSING]
+)
+
 # NCMs de MEDICAMENTOS (capítulo 30 e outros farmacêuticos)
 NCM_MEDICAMENTO_PREFIXES = (
     "3001",  # Glândulas e outros órgãos para usos opoterápicos
@@ -82,6 +124,9 @@ NCM_MATERIAL_PREFIXES = (
     "27111910",  # GLP (não é material hospitalar, mas comum em notas hospitalares)
 )
 
+# NCMs de medicamento que também podem ser material (decide pela descrição)
+NCM_AMBIGUOUS_PREFIXES = ("3005", "3006")
+
 # Níveis de revisão (sempre REVIEW como decisão, mas com severidade)
 REVIEW_LEVEL_LOW = "LOW"
 REVIEW_LEVEL_MEDIUM = "MEDIUM"
@@ -96,6 +141,72 @@ CLASS_MATERIAL = "MATERIAL_HOSPITALAR"
 CLASS_GENERICO = "GENERICO"
 
 
+def _build_ncm_lookup() -> dict[int, dict[str, tuple[str, tuple[str, ...], bool]]]:
+    """
+    Indexa os prefixos de NCM por tamanho: {tamanho: {prefixo: (classe, reasons, ambíguo)}}.
+    
+    Prefixos de material e medicamento não se sobrepõem, então a busca pelo
+    prefixo mais longo equivale à ordem "material primeiro" das tuplas acima.
+    """
+    lookup: dict[int, dict[str, tuple[str, tuple[str, ...], bool]]] = {}
+    for prefix in NCM_MEDICAMENTO_PREFIXES:
+        lookup.setdefault(len(prefix), {})[prefix] = (
+            CLASS_MEDICAMENTO,
+            _REASONS_MED_BY_NCM,
+            prefix in NCM_AMBIGUOUS_PREFIXES,
+        )
+    for prefix in NCM_MATERIAL_PREFIXES:
+        lookup.setdefault(len(prefix), {})[prefix] = (
+            CLASS_MATERIAL,
+            _REASONS_MATERIAL_BY_NCM,
+            False,
+        )
+    return lookup
+
+
+_NCM_LOOKUP = _build_ncm_lookup()
+_NCM_PREFIX_LENGTHS = tuple(sorted(_NCM_LOOKUP, reverse=True))  # (8, 6, 4)
+
+
+@lru_cache(maxsize=4096)
+def _ncm_rule(ncm: str) -> tuple[str, tuple[str, ...], bool] | None:
+    """
+    Retorna a regra do prefixo de NCM mais longo que casar (até 3 lookups).
+    
+    Cacheado pelo NCM bruto: o mesmo NCM se repete muito dentro de um lote.
+    """
+    # Extrai apenas dígitos do NCM (normalmente já vem só com dígitos)
+    ncm_digits = ncm if ncm.isdigit() else "".join(filter(str.isdigit, ncm))
+    
+    for size in _NCM_PREFIX_LENGTHS:
+        rule = _NCM_LOOKUP[size].get(ncm_digits[:size])
+        if rule is not None:
+            return rule
+    return None
+
+
+@lru_cache(maxsize=8)
+def _compile_keywords(keywords: tuple[str, ...]) -> re.Pattern[str]:
+    """
+    Compila as keywords numa única alternation (busca por substring em C).
+    
+    Equivale a testar cada keyword com `in`. Cacheado pela tupla de
+    keywords, então mudanças nas settings geram um novo padrão.
+    """
+    if not keywords:
+        return re.compile(r"(?!)")  # nunca casa
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    return re.compile("|".join(re.escape(k) for k in ordered))
+
+
+def _keywords() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Lê as keywords das settings: (keywords_material, keywords_medicamento)."""
+    return (
+        tuple(settings.material_keywords_list),
+        tuple(settings.medicamento_keywords_list),
+    )
+
+
 # =============================================================================
 # Classificação
 # =============================================================================
@@ -103,7 +214,8 @@ CLASS_GENERICO = "GENERICO"
 def _classify_by_ncm_and_keywords(
     ncm: str | None,
     xprod: str | None,
-) -> tuple[str, list[str]]:
+    keywords: tuple[tuple[str, ...], tuple[str, ...]] | None = None,
+) -> tuple[str, tuple[str, ...]]:
     """
     Classifica item com base em NCM e keywords na descrição.
     
@@ -117,140 +229,150 @@ def _classify_by_ncm_and_keywords(
     Args:
         ncm: Código NCM do produto
         xprod: Descrição do produto
+        keywords: (material, medicamento) em maiúsculas (padrão: config)
         
     Returns:
-        Tupla (classe, lista de reasons)
+        Tupla (classe, reasons) — a tupla de reasons é compartilhada, não mutar
     """
-    reasons: list[str] = []
-    
-    # Extrai apenas dígitos do NCM
-    ncm_digits = "".join(c for c in (ncm or "") if c.isdigit())
+    # Carrega keywords quando o chamador não informou
+    if keywords is None:
+        keywords = _keywords()
     
     # Descrição em maiúsculas para comparação
-    xp = (xprod or "").upper()
-    
-    # Carrega keywords
-    material_keywords = settings.material_keywords_list
-    medicamento_keywords = settings.medicamento_keywords_list
+    return _classify_cached(ncm or "", (xprod or "").upper(), keywords)
+
+
+@lru_cache(maxsize=8192)
+def _classify_cached(
+    ncm: str,
+    xp: str,
+    keywords: tuple[tuple[str, ...], tuple[str, ...]],
+) -> tuple[str, tuple[str, ...]]:
+    """
+    Núcleo de `_classify_by_ncm_and_keywords`, memoizado.
     
-    # ========================================================================
-    # 1) Verifica NCM de MATERIAL HOSPITALAR primeiro (mais específico)
-    # ========================================================================
-    # NCMs de material hospitalar são muito específicos (seringas, luvas, etc.)
-    for prefix in NCM_MATERIAL_PREFIXES:
-        if ncm_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_MATERIAL_BY_NCM)
-            return CLASS_MATERIAL, reasons
+    Lotes reais repetem o mesmo par (NCM, descrição) muitas vezes; as tuplas
+    de keywords fazem parte da chave (hash barato, ao contrário do padrão
+    compilado), então mudar as keywords invalida o cache. Os padrões só são
+    buscados em _compile_keywords quando a chave não está no cache.
+    """
+    material_re = _compile_keywords(keywords[0])
+    medicamento_re = _compile_keywords(keywords[1])
     
     # ========================================================================
-    # 2) Verifica NCM de MEDICAMENTO
+    # 1-2) NCM de MATERIAL HOSPITALAR / MEDICAMENTO (prefixo mais longo primeiro)
     # ========================================================================
-    for prefix in NCM_MEDICAMENTO_PREFIXES:
-        if ncm_digits.startswith(prefix):
-            # NCM 3005 e 3006 podem ser materiais ou medicamentos
-            # Usa heurística adicional pela descrição
-            if prefix in ("3005", "3006"):
-                # Se descrição indica material, classifica como material
-                if any(k in xp for k in material_keywords):
-                    reasons.append(REASON_CLASS_MATERIAL_BY_KEYWORD)
-                    return CLASS_MATERIAL, reasons
-            reasons.append(REASON_CLASS_MED_BY_NCM)
-            return CLASS_MEDICAMENTO, reasons
+    rule = _ncm_rule(ncm)
+    if rule is not None:
+        ncm_class, ncm_reasons, ambiguous = rule
+        # NCM 3005 e 3006 podem ser materiais ou medicamentos
+        # Usa heurística adicional pela descrição
+        if ambiguous and material_re.search(xp) is not None:
+            return CLASS_MATERIAL, _REASONS_MATERIAL_BY_KEYWORD
+        return ncm_class, ncm_reasons
     
     # ========================================================================
     # 3) Keywords de MATERIAL HOSPITALAR na descrição
     # ========================================================================
-    if any(k in xp for k in material_keywords):
-        reasons.append(REASON_CLASS_MATERIAL_BY_KEYWORD)
-        return CLASS_MATERIAL, reasons
+    if material_re.search(xp) is not None:
+        return CLASS_MATERIAL, _REASONS_MATERIAL_BY_KEYWORD
     
     # ========================================================================
     # 4) Keywords de MEDICAMENTO na descrição
     # ========================================================================
-    if any(k in xp for k in medicamento_keywords):
-        reasons.append(REASON_CLASS_MED_BY_KEYWORD)
-        return CLASS_MEDICAMENTO, reasons
+    if medicamento_re.search(xp) is not None:
+        return CLASS_MEDICAMENTO, _REASONS_MED_BY_KEYWORD
     
     # ========================================================================
     # 5) Fallback - não conseguiu classificar
     # ========================================================================
-    reasons.append(REASON_CLASS_GENERIC_FALLBACK)
-    return CLASS_GENERICO, reasons
+    return CLASS_GENERICO, _REASONS_GENERIC_FALLBACK
 
 
-def _review_level_from_reasons(
-    reasons: list[str],
+def _review_level_from_mask(
+    reason_mask: int,
     flags: dict[str, Any],
 ) -> str:
     """
-    Determina nível de revisão baseado nos reasons.
+    Determina nível de revisão a partir da máscara de reasons (REASON_BITS).
     
     HIGH: faltam chaves fiscais mínimas, ou item sem descrição/código
     MEDIUM: total divergente, qty/preço ausente
     LOW: apenas classificação por heurística / cadastro pendente
     """
-    high_reasons = {
-        REASON_PRODUCT_CODE_MISSING,
-        REASON_PRODUCT_DESC_MISSING,
-        REASON_NCM_MISSING,
-        REASON_CFOP_MISSING,
-    }
-    
-    if any(r in high_reasons for r in reasons):
+    if reason_mask & _HIGH_MASK:
         return REVIEW_LEVEL_HIGH
     
     if flags.get("has_minimum_fiscal_keys") is False:
         return REVIEW_LEVEL_HIGH
     
-    medium_reasons = {
-        REASON_TOTAL_ITEM_INVALID,
-        REASON_QTY_OR_PRICE_MISSING,
-    }
-    
-    if any(r in medium_reasons for r in reasons):
+    if reason_mask & _MEDIUM_MASK:
         return REVIEW_LEVEL_MEDIUM
     
     return REVIEW_LEVEL_LOW
 
 
-def _build_review_text_ptbr(product_class: str, reasons: list[str]) -> str:
-    """
-    Gera texto explicativo em PT-BR para o operador.
-    """
-    parts: list[str] = []
-    
-    # Classificação com base na evidência
-    if REASON_CLASS_MED_BY_NCM in reasons:
-        parts.append("Classificação: MEDICAMENTO (NCM de farmacêutico identificado).")
-    elif REASON_CLASS_MED_BY_KEYWORD in reasons:
-        parts.append("Classificação: MEDICAMENTO (descrição contém termos farmacêuticos).")
-    elif REASON_CLASS_MATERIAL_BY_NCM in reasons:
-        parts.append("Classificação: MATERIAL HOSPITALAR (NCM de instrumentos/dispositivos médicos).")
-    elif REASON_CLASS_MATERIAL_BY_KEYWORD in reasons:
-        parts.append("Classificação: MATERIAL HOSPITALAR (descrição contém termos de materiais).")
-    elif product_class == CLASS_MEDICAMENTO:
-        parts.append("Classificação sugerida: MEDICAMENTO.")
-    elif product_class == CLASS_MATERIAL:
-        parts.append("Classificação sugerida: MATERIAL HOSPITALAR.")
+# Frase de classificação por reason, em ordem de prioridade
+_CLASS_PHRASES = (
+    (REASON_BITS[REASON_CLASS_MED_BY_NCM],
+     "Classificação: MEDICAMENTO (NCM de farmacêutico identificado)."),
+    (REASON_BITS[REASON_CLASS_MED_BY_KEYWORD],
+     "Classificação: MEDICAMENTO (descrição contém termos farmacêuticos)."),
+    (REASON_BITS[REASON_CLASS_MATERIAL_BY_NCM],
+     "Classificação: MATERIAL HOSPITALAR (NCM de instrumentos/dispositivos médicos)."),
+    (REASON_BITS[REASON_CLASS_MATERIAL_BY_KEYWORD],
+     "Classificação: MATERIAL HOSPITALAR (descrição contém termos de materiais)."),
+)
+
+# Frase de classificação sem reason de evidência (pela classe)
+_CLASS_DEFAULT_PHRASES = {
+    CLASS_MEDICAMENTO: "Classificação sugerida: MEDICAMENTO.",
+    CLASS_MATERIAL: "Classificação sugerida: MATERIAL HOSPITALAR.",
+}
+_CLASS_FALLBACK_PHRASE = (
+    "Classificação: GENÉRICO (não foi possível identificar como medicamento ou material)."
+)
+
+# Alertas: (máscara de reasons, frase), na ordem de exibição
+_ALERT_PHRASES = (
+    (_NCM_MISSING_BIT | _CFOP_MISSING_BIT,
+     "Faltam chaves fiscais (NCM/CFOP) — conferir XML."),
+    (REASON_BITS[REASON_PRODUCT_CODE_MISSING] | REASON_BITS[REASON_PRODUCT_DESC_MISSING],
+     "Faltam dados básicos do item (código/descrição) — conferir XML."),
+    (_TOTAL_INVALID_BIT,
+     "Total do item (vProd) não bate com qCom × vUnCom — conferir."),
+    (REASON_BITS[REASON_QTY_OR_PRICE_MISSING],
+     "Quantidade ou preço unitário ausente/zero — conferir."),
+)
+
+
+@lru_cache(maxsize=256)
+def _review_text_from_mask(product_class: str, reason_mask: int) -> str:
+    """Texto de revisão a partir da máscara de reasons (poucas combinações: cacheado)."""
+    for bit, phrase in _CLASS_PHRASES:
+        if reason_mask & bit:
+            parts = [phrase]
+            break
     else:
-        parts.append("Classificação: GENÉRICO (não foi possível identificar como medicamento ou material).")
-    
-    # Alertas por reason
-    if REASON_NCM_MISSING in reasons or REASON_CFOP_MISSING in reasons:
-        parts.append("Faltam chaves fiscais (NCM/CFOP) — conferir XML.")
+        parts = [_CLASS_DEFAULT_PHRASES.get(product_class, _CLASS_FALLBACK_PHRASE)]
     
-    if REASON_PRODUCT_CODE_MISSING in reasons or REASON_PRODUCT_DESC_MISSING in reasons:
-        parts.append("Faltam dados básicos do item (código/descrição) — conferir XML.")
-    
-    if REASON_TOTAL_ITEM_INVALID in reasons:
-        parts.append("Total do item (vProd) não bate com qCom × vUnCom — conferir.")
-    
-    if REASON_QTY_OR_PRICE_MISSING in reasons:
-        parts.append("Quantidade ou preço unitário ausente/zero — conferir.")
+    for mask, phrase in _ALERT_PHRASES:
+        if reason_mask & mask:
+            parts.append(phrase)
     
     return " ".join(parts)
 
 
+def _build_review_text_ptbr(product_class: str, reasons: list[str]) -> str:
+    """
+    Gera texto explicativo em PT-BR para o operador.
+    """
+    reason_mask = 0
+    for r in reasons:
+        reason_mask |= REASON_BITS.get(r, 0)
+    return _review_text_from_mask(product_class, reason_mask)
+
+
 # =============================================================================
 # API Pública
 # =============================================================================
@@ -259,6 +381,7 @@ def normalize_nfe_item(
     item: dict[str, Any],
     *,
     vprod_tolerance: float | None = None,
+    keywords: tuple[tuple[str, ...], tuple[str, ...]] | None = None,
 ) -> dict[str, Any]:
     """
     Normaliza UM item de NF-e.
@@ -266,6 +389,7 @@ def normalize_nfe_item(
     Args:
         item: Dicionário com dados do item
         vprod_tolerance: Tolerância para divergência de vProd (padrão: config)
+        keywords: (material, medicamento) em maiúsculas (padrão: config)
         
     Returns:
         Dicionário com:
@@ -277,53 +401,121 @@ def normalize_nfe_item(
         - review_level: LOW/MEDIUM/HIGH
         - review_text_ptbr: explicação
     """
+    out, _ = _normalize_item(
+        item,
+        vprod_tolerance=vprod_tolerance,
+        keywords=keywords,
+    )
+    return out
+
+
+def _normalize_item(
+    item: dict[str, Any],
+    *,
+    vprod_tolerance: float | None = None,
+    keywords: tuple[tuple[str, ...], tuple[str, ...]] | None = None,
+    copy: bool = True,
+) -> tuple[dict[str, Any], int]:
+    """
+    Implementação de `normalize_nfe_item`; retorna também a máscara de reasons.
+    
+    Com copy=False o dict do item é sanitizado no lugar (sem cópia).
+    """
     if vprod_tolerance is None:
         vprod_tolerance = settings.item_vprod_tolerance
+    if keywords is None:
+        keywords = _keywords()
     
     reasons: list[str] = []
+    reason_mask = 0
     norm_flags: dict[str, Any] = {}
     
-    # Copia para não modificar original
-    it = dict(item or {})
-    
-    # Sanitizações pontuais
-    it["cProd"] = sanitize_product_code(it.get("cProd"))
-    it["xProd"] = normalize_text_or_none(it.get("xProd"))
-    it["NCM"] = normalize_text_or_none(it.get("NCM"))
-    it["CFOP"] = normalize_text_or_none(it.get("CFOP"))
-    
-    cProd = it.get("cProd")
-    xProd = it.get("xProd")
-    ncm = it.get("NCM")
-    cfop = it.get("CFOP")
-    qCom = it.get("qCom")
-    vUnCom = it.get("vUnCom")
-    vProd = it.get("vProd")
+    # Copia para não modificar original (salvo quando o chamador é dono do item)
+    if copy or not isinstance(item, dict):
+        it = dict(item or {})
+    else:
+        it = item
+    
+    # Sanitizações pontuais. Códigos se repetem muito entre itens/notas:
+    # internados, o lote guarda um único objeto por valor
+    cProd = sanitize_product_code(it.get("cProd"))
+    xProd = normalize_text_or_none(it.get("xProd"))
+    ncm = normalize_text_or_none(it.get("NCM"))
+    cfop = normalize_text_or_none(it.get("CFOP"))
+    
+    it["cProd"] = cProd = sys.intern(cProd) if cProd else cProd
+    it["xProd"] = xProd
+    it["NCM"] = ncm = sys.intern(ncm) if ncm else ncm
+    it["CFOP"] = cfop = sys.intern(cfop) if cfop else cfop
+    
+    # Valores numéricos convertidos uma única vez
+    fq = safe_float(it.get("qCom"))
+    fv = safe_float(it.get("vUnCom"))
+    fvprod = safe_float(it.get("vProd"))
+    
+    # Caminho rápido (a maioria dos itens reais): campos presentes, qty/preço
+    # positivos e vProd dentro da tolerância => só reasons de classificação
+    if (
+        cProd and xProd and ncm and cfop
+        and fq is not None and fq > 0
+        and fv is not None and fv > 0
+        and fvprod is not None
+    ):
+        expected = round(fq * fv, 2)
+        diff = round(fvprod - expected, 2)
+        if abs(diff) <= float(vprod_tolerance):
+            product_class, class_reasons = _classify_by_ncm_and_keywords(ncm, xProd, keywords)
+            for r in class_reasons:
+                reason_mask |= REASON_BITS[r]
+            
+            return {
+                "item": it,
+                "normalized": {
+                    "product_class": product_class,
+                    "suggested_group": product_class,
+                },
+                "decision": DECISION_REVIEW,
+                "reasons": list(class_reasons),
+                "norm_flags": {
+                    "expected_vProd": expected,
+                    "diff_vProd_vs_expected": diff,
+                    "vProd_invalid": False,
+                    "has_minimum_fiscal_keys": True,
+                    "requires_product_registration": True,
+                },
+                "review_level": REVIEW_LEVEL_LOW,
+                "review_text_ptbr": _review_text_from_mask(product_class, reason_mask),
+            }, reason_mask
     
     # Validação de qualidade mínima
     if not cProd:
         reasons.append(REASON_PRODUCT_CODE_MISSING)
+        reason_mask |= REASON_BITS[REASON_PRODUCT_CODE_MISSING]
     if not xProd:
         reasons.append(REASON_PRODUCT_DESC_MISSING)
+        reason_mask |= REASON_BITS[REASON_PRODUCT_DESC_MISSING]
     if not ncm:
         reasons.append(REASON_NCM_MISSING)
+        reason_mask |= REASON_BITS[REASON_NCM_MISSING]
     if not cfop:
         reasons.append(REASON_CFOP_MISSING)
+        reason_mask |= REASON_BITS[REASON_CFOP_MISSING]
     
-    if not is_positive_number(qCom) or not is_positive_number(vUnCom):
+    if not (fq is not None and fq > 0) or not (fv is not None and fv > 0):
         reasons.append(REASON_QTY_OR_PRICE_MISSING)
+        reason_mask |= REASON_BITS[REASON_QTY_OR_PRICE_MISSING]
     
-    # Consistência vProd
-    expected = calculate_expected_vprod(qCom, vUnCom)
+    # Consistência vProd (qCom × vUnCom)
+    expected = round(fq * fv, 2) if fq is not None and fv is not None else None
     norm_flags["expected_vProd"] = expected
     
-    fvprod = safe_float(vProd)
     if expected is not None and fvprod is not None:
         diff = round(fvprod - expected, 2)
         norm_flags["diff_vProd_vs_expected"] = diff
         
         if abs(diff) > float(vprod_tolerance):
             reasons.append(REASON_TOTAL_ITEM_INVALID)
+            reason_mask |= REASON_BITS[REASON_TOTAL_ITEM_INVALID]
             norm_flags["vProd_invalid"] = True
         else:
             norm_flags["vProd_invalid"] = False
@@ -336,12 +528,13 @@ def normalize_nfe_item(
     norm_flags["requires_product_registration"] = True  # sempre item genérico no RM
     
     # Classificação
-    product_class, class_reasons = _classify_by_ncm_and_keywords(ncm, xProd)
+    product_class, class_reasons = _classify_by_ncm_and_keywords(ncm, xProd, keywords)
     
     # Adiciona reasons de classificação sem duplicar
     for r in class_reasons:
         if r not in reasons:
             reasons.append(r)
+            reason_mask |= REASON_BITS[r]
     
     normalized = {
         "product_class": product_class,
@@ -349,8 +542,8 @@ def normalize_nfe_item(
     }
     
     # Decisão e explicação
-    review_level = _review_level_from_reasons(reasons, norm_flags)
-    review_text_ptbr = _build_review_text_ptbr(product_class, reasons)
+    review_level = _review_level_from_mask(reason_mask, norm_flags)
+    review_text_ptbr = _review_text_from_mask(product_class, reason_mask)
     
     return {
         "item": it,
@@ -360,11 +553,69 @@ def normalize_nfe_item(
         "norm_flags": norm_flags,
         "review_level": review_level,
         "review_text_ptbr": review_text_ptbr,
+    }, reason_mask
+
+
+# =============================================================================
+# Normalização em lote
+# =============================================================================
+
+def _summary_from_mask_counts(mask_counts: dict[int, int]) -> dict[str, Any]:
+    """
+    Monta o summary do lote a partir da contagem por máscara de reasons.
+    
+    O nível de revisão depende só da máscara (has_minimum_fiscal_keys falso
+    implica NCM/CFOP ausente, já em _HIGH_MASK), então as poucas máscaras
+    distintas bastam para todos os contadores.
+    """
+    count_review = 0
+    count_missing_ncm = 0
+    count_missing_cfop = 0
+    count_total_invalid = 0
+    
+    review_high = 0
+    review_medium = 0
+    review_low = 0
+    
+    for mask, n in mask_counts.items():
+        count_review += n
+        
+        if mask & _NCM_MISSING_BIT:
+            count_missing_ncm += n
+        if mask & _CFOP_MISSING_BIT:
+            count_missing_cfop += n
+        if mask & _TOTAL_INVALID_BIT:
+            count_total_invalid += n
+        
+        level = _review_level_from_mask(mask, {})
+        if level == REVIEW_LEVEL_HIGH:
+            review_high += n
+        elif level == REVIEW_LEVEL_MEDIUM:
+            review_medium += n
+        else:
+            review_low += n
+    
+    return {
+        "decision_summary": {
+            "review": count_review,
+        },
+        "quality_summary": {
+            "missing_ncm": count_missing_ncm,
+            "missing_cfop": count_missing_cfop,
+            "item_total_invalid": count_total_invalid,
+        },
+        "review_summary": {
+            "high": review_high,
+            "medium": review_medium,
+            "low": review_low,
+        },
     }
 
 
 def normalize_nfe_items(
     rows: list[dict[str, Any]],
+    *,
+    copy: bool = True,
 ) -> tuple[list[dict[str, Any]], dict[str, Any]]:
     """
     Normaliza uma lista de itens no formato do extractor.
@@ -372,29 +623,37 @@ def normalize_nfe_items(
     Args:
         rows: Lista de dicts com formato:
             { item: {...}, confidence, missing_fields, ... }
+        copy: Se False, mescla o resultado nas próprias rows (e sanitiza o
+            item no lugar) em vez de copiá-las — use só quando as rows não
+            são compartilhadas com mais ninguém.
     
     Returns:
         Tupla:
         - rows_enriched: lista com normalized/decision/reasons/etc mesclados
         - summary: agregações para dashboard
     """
-    enriched: list[dict[str, Any]] = []
+    # Settings lidas uma vez por lote (não por item)
+    vprod_tolerance = settings.item_vprod_tolerance
+    keywords = _keywords()
     
-    # Contadores
-    count_review = 0
-    count_missing_ncm = 0
-    count_missing_cfop = 0
-    count_total_invalid = 0
+    enriched: list[dict[str, Any]] = []
     
-    review_high = 0
-    review_medium = 0
-    review_low = 0
+    # Um único contador por máscara; os totais do summary saem dela no fim
+    mask_counts: dict[int, int] = {}
     
     for row in rows or []:
-        base_row = dict(row or {})
+        if copy or not isinstance(row, dict):
+            base_row = dict(row or {})
+        else:
+            base_row = row
         it = (base_row.get("item") or {}) if isinstance(base_row, dict) else {}
         
-        out = normalize_nfe_item(it)
+        out, reason_mask = _normalize_item(
+            it,
+            vprod_tolerance=vprod_tolerance,
+            keywords=keywords,
+            copy=copy,
+        )
         
         # Mescla resultado na row
         base_row["item"] = out["item"]
@@ -406,37 +665,6 @@ def normalize_nfe_items(
         base_row["review_text_ptbr"] = out["review_text_ptbr"]
         
         enriched.append(base_row)
-        count_review += 1
-        
-        # Contagens
-        if REASON_NCM_MISSING in out["reasons"]:
-            count_missing_ncm += 1
-        if REASON_CFOP_MISSING in out["reasons"]:
-            count_missing_cfop += 1
-        if REASON_TOTAL_ITEM_INVALID in out["reasons"]:
-            count_total_invalid += 1
-        
-        if out["review_level"] == REVIEW_LEVEL_HIGH:
-            review_high += 1
-        elif out["review_level"] == REVIEW_LEVEL_MEDIUM:
-            review_medium += 1
-        else:
-            review_low += 1
-    
-    summary = {
-        "decision_summary": {
-            "review": count_review,
-        },
-        "quality_summary": {
-            "missing_ncm": count_missing_ncm,
-            "missing_cfop": count_missing_cfop,
-            "item_total_invalid": count_total_invalid,
-        },
-        "review_summary": {
-            "high": review_high,
-            "medium": review_medium,
-            "low": review_low,
-        },
-    }
+        mask_counts[reason_mask] = mask_counts.get(reason_mask, 0) + 1
     
-    return enriched, summary
+    return enriched, _summary_from_mask_counts(mask_counts)
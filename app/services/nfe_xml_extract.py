@@ -13,10 +13,14 @@ from __future__ import annotations
 import csv
 import hashlib
 import io
-import xml.etree.ElementTree as ET
 from dataclasses import dataclass
-from typing import Any
+from functools import lru_cache
+from operator import attrgetter
+from typing import IO, Any
 
+from lxml import etree as ET  # parser em C; API compatível com ElementTree
+
+from app.core.exceptions import XMLParseError
 from app.utils.converters import (
     digits_only_or_none,
     format_datetime_br,
@@ -32,16 +36,77 @@ NFE_NS = {"nfe": "http://www.portalfiscal.inf.br/nfe"}
 
 
 def _sha256(data: bytes) -> str:
-    """Calcula hash SHA256 dos bytes."""
+    """Calcula hash SHA256 dos bytes (hashlib usa o SHA-256 do OpenSSL)."""
     return hashlib.sha256(data).hexdigest()
 
 
-def _findtext(root: ET.Element, xpath: str) -> str | None:
-    """Busca texto em elemento XML com namespace NF-e."""
-    return root.findtext(xpath, default=None, namespaces=NFE_NS)
+_EMPTY_SHA256 = _sha256(b"")
+
+
+_NFE_PREFIX = "{" + NFE_NS["nfe"] + "}"
+
+
+def _qualify(path: str, prefix: str) -> str:
+    """Aplica `prefix` a cada passo de um caminho de nomes locais."""
+    return "/".join(p if p in ("", ".") else prefix + p for p in path.split("/"))
+
+
+@lru_cache(maxsize=256)
+def _q(path: str) -> str:
+    """
+    Qualifica um caminho de nomes locais com o namespace NF-e ({ns}tag).
+    
+    Ex.: ".//prod/cProd" -> ".//{ns}prod/{ns}cProd". Com a tag já qualificada
+    o find não resolve prefixos a cada chamada, e tags sem namespace (ou de
+    outro namespace) continuam não casando.
+    """
+    return _qualify(path, _NFE_PREFIX)
+
+
+@lru_cache(maxsize=256)
+def _xpath(path: str):
+    """
+    XPath compilado (lxml) equivalente ao find do caminho de nomes locais.
+    
+    Compilado uma vez por caminho; no lxml o find passa pelo ElementPath
+    em Python, o XPath avalia direto em C.
+    """
+    return ET.XPath(_qualify(path, "nfe:"), namespaces=NFE_NS)
+
+
+_TAG_DET = _q("det")
+_TAG_NFE = _q("NFe")
+_TAG_PROTNFE = _q("protNFe")
+
+# Seções do documento guardadas durante o streaming (tag -> chave)
+_SECTION_TAGS = {
+    _q("ide"): "ide",
+    _q("emit"): "emit",
+    _q("dest"): "dest",
+    _q("total"): "total",
+}
+
+# Únicas tags que o streaming precisa ver (lxml filtra as demais em C)
+_STREAM_TAGS = (_TAG_DET, _TAG_NFE, _TAG_PROTNFE, *_SECTION_TAGS)
+
+
+def _find(el: ET.Element | None, path: str) -> ET.Element | None:
+    """Primeiro elemento no caminho de nomes locais NF-e (None se ausente)."""
+    if el is None:
+        return None
+    found = _xpath(path)(el)
+    return found[0] if found else None
+
+
+def _findtext(el: ET.Element | None, path: str) -> str | None:
+    """Texto no caminho de nomes locais NF-e (None se ausente; "" se vazio)."""
+    if el is None:
+        return None
+    found = _xpath(path)(el)
+    return (found[0].text or "") if found else None
 
 
-def _safe_get_chave_from_nfeproc(root: ET.Element) -> str | None:
+def _chave_from_sections(ch_prot: str | None, inf_id: str | None) -> str | None:
     """
     Extrai chave de acesso da NF-e.
     
@@ -49,39 +114,130 @@ def _safe_get_chave_from_nfeproc(root: ET.Element) -> str | None:
     1) nfeProc/protNFe/infProt/chNFe
     2) NFe/infNFe/@Id => "NFe<chave>"
     """
-    ch = _findtext(root, ".//nfe:protNFe/nfe:infProt/nfe:chNFe")
-    if ch:
-        return digits_only_or_none(ch)
-    
-    inf = root.find(".//nfe:NFe/nfe:infNFe", namespaces=NFE_NS)
-    if inf is not None:
-        _id = inf.attrib.get("Id")
-        if _id:
-            # Id geralmente "NFe{44dig}"
-            digits = digits_only_or_none(_id)
-            if digits and len(digits) >= 44:
-                return digits[-44:]
+    if ch_prot:
+        return digits_only_or_none(ch_prot)
+    
+    if inf_id:
+        # Id geralmente "NFe{44dig}"
+        digits = digits_only_or_none(inf_id)
+        if digits and len(digits) >= 44:
+            return digits[-44:]
     
     return None
 
 
+def _iterparse(xml_bytes: bytes):
+    """
+    iterparse (eventos "end") sobre os bytes do XML.
+    
+    Parser endurecido: sem carregar DTD, sem resolver entidades, sem rede e
+    sem árvores gigantes. Só as tags de _STREAM_TAGS geram eventos.
+    """
+    return ET.iterparse(
+        io.BytesIO(xml_bytes),
+        events=("end",),
+        tag=_STREAM_TAGS,
+        load_dtd=False,
+        resolve_entities=False,
+        no_network=True,
+        huge_tree=False,
+        collect_ids=False,
+        remove_comments=True,  # como o ElementTree: só elementos na árvore
+        remove_pis=True,
+    )
+
+
+def _parse_sections(
+    xml_bytes: bytes,
+    item_range: range | None = None,
+) -> tuple[dict[str, Any], list[_ItemRecord]]:
+    """
+    Faz parse em streaming (iterparse) guardando só o que a extração usa.
+    
+    Cada <det> é extraído assim que fecha, tem a subárvore descartada e o
+    <det> anterior é desanexado da árvore, então o pico de memória não
+    cresce com a quantidade de itens.
+    
+    Com item_range, só os itens nessas posições são extraídos por completo;
+    os demais trazem apenas nItem e <prod> (o suficiente para o sumário).
+    
+    Returns:
+        Tupla (seções, itens extraídos como _ItemRecord). Seções: ide, emit, dest, total
+        (elementos ou None), ch_prot e inf_id (strings ou None).
+    
+    Raises:
+        ET.ParseError se o XML for inválido; XMLParseError se declarar DTD.
+    """
+    sections: dict[str, Any] = {
+        "ide": None,
+        "emit": None,
+        "dest": None,
+        "total": None,
+        "ch_prot": None,
+        "inf_id": None,
+    }
+    items: list[_ItemRecord] = []
+    
+    nfe_el: ET.Element | None = None
+    
+    context = _iterparse(xml_bytes)
+    for _event, el in context:
+        tag = el.tag
+        
+        if tag == _TAG_DET:
+            if item_range is None or len(items) in item_range:
+                items.append(_extract_item(el))
+            else:
+                items.append(_extract_prod(el, _item_children(el)[0]))
+            el.clear()
+            # Desanexa o <det> anterior (já vazio): só o atual fica na árvore
+            prev = el.getprevious()
+            if prev is not None and prev.tag == _TAG_DET:
+                el.getparent().remove(prev)
+            continue
+        
+        key = _SECTION_TAGS.get(tag)
+        if key is not None:
+            if sections[key] is None:
+                sections[key] = el
+        elif tag == _TAG_PROTNFE:
+            if sections["ch_prot"] is None:
+                sections["ch_prot"] = _findtext(el, "infProt/chNFe") or None
+        elif tag == _TAG_NFE:
+            if nfe_el is None and _find(el, "infNFe") is not None:
+                nfe_el = el
+    
+    # NF-e não usa DTD: documento que declara um é recusado (as entidades
+    # já não foram resolvidas pelo parser)
+    if context.root.getroottree().docinfo.doctype:
+        raise XMLParseError("DTD/entidades não são permitidos em NF-e")
+    
+    # Id só vale para NFe aninhada (nfeProc/NFe), como no XPath .//NFe/infNFe
+    if nfe_el is not None and nfe_el is not context.root:
+        inf = _find(nfe_el, "infNFe")
+        sections["inf_id"] = inf.attrib.get("Id")
+    
+    return sections, items
+
+
 # =============================================================================
 # Extração de seções
 # =============================================================================
 
-def _extract_header(root: ET.Element) -> dict[str, Any]:
+def _extract_header(sections: dict[str, Any]) -> dict[str, Any]:
     """Extrai cabeçalho da NF-e."""
-    nNF = _findtext(root, ".//nfe:ide/nfe:nNF")
-    serie = _findtext(root, ".//nfe:ide/nfe:serie")
-    dhEmi = _findtext(root, ".//nfe:ide/nfe:dhEmi") or _findtext(root, ".//nfe:ide/nfe:dEmi")
-    natOp = _findtext(root, ".//nfe:ide/nfe:natOp")
-    tpNF = _findtext(root, ".//nfe:ide/nfe:tpNF")  # 0=entrada, 1=saída
-    tpAmb = _findtext(root, ".//nfe:ide/nfe:tpAmb")
+    ide = sections.get("ide")
+    nNF = _findtext(ide, "nNF")
+    serie = _findtext(ide, "serie")
+    dhEmi = _findtext(ide, "dhEmi") or _findtext(ide, "dEmi")
+    natOp = _findtext(ide, "natOp")
+    tpNF = _findtext(ide, "tpNF")  # 0=entrada, 1=saída
+    tpAmb = _findtext(ide, "tpAmb")
     
     dt = parse_iso_datetime(dhEmi)
     
     return {
-        "chave_nfe": _safe_get_chave_from_nfeproc(root),
+        "chave_nfe": _chave_from_sections(sections.get("ch_prot"), sections.get("inf_id")),
         "numero": safe_int(nNF),
         "serie": safe_int(serie),
         "data_emissao": format_datetime_br(dt),
@@ -91,21 +247,22 @@ def _extract_header(root: ET.Element) -> dict[str, Any]:
     }
 
 
-def _extract_party(root: ET.Element, kind: str) -> dict[str, Any]:
+def _extract_party(party: ET.Element | None, kind: str) -> dict[str, Any]:
     """
     Extrai dados de emitente ou destinatário.
     
     Args:
-        root: Elemento raiz do XML
+        party: Elemento <emit> ou <dest> (None se ausente)
         kind: "emit" ou "dest"
     """
-    base = f".//nfe:{kind}"
-    cnpj = _findtext(root, base + "/nfe:CNPJ") or _findtext(root, base + "/nfe:CPF")
-    xNome = _findtext(root, base + "/nfe:xNome")
+    cnpj = _findtext(party, "CNPJ") or _findtext(party, "CPF")
+    xNome = _findtext(party, "xNome")
     
+    # Endereço buscado uma vez; UF/município lidos como filhos diretos
     ender_suffix = "Emit" if kind == "emit" else "Dest"
-    uf = _findtext(root, f"{base}/nfe:ender{ender_suffix}/nfe:UF")
-    mun = _findtext(root, f"{base}/nfe:ender{ender_suffix}/nfe:xMun")
+    ender = _find(party, f"ender{ender_suffix}")
+    uf = _findtext(ender, "UF")
+    mun = _findtext(ender, "xMun")
     
     return {
         "doc": digits_only_or_none(cnpj),
@@ -115,21 +272,31 @@ def _extract_party(root: ET.Element, kind: str) -> dict[str, Any]:
     }
 
 
-def _extract_totals(root: ET.Element) -> dict[str, Any]:
+# Campo de saída -> tag filha de ICMSTot
+_TOTALS_FIELDS = {
+    "vNF": "vNF",
+    "vProd": "vProd",
+    "vDesc": "vDesc",
+    "vFrete": "vFrete",
+    "vOutro": "vOutro",
+    "vICMS": "vICMS",
+    "vICMSST": "vST",
+    "vIPI": "vIPI",
+    "vPIS": "vPIS",
+    "vCOFINS": "vCOFINS",
+}
+
+
+def _extract_totals(total: ET.Element | None) -> dict[str, Any]:
     """Extrai totais (ICMSTot) da NF-e."""
-    prefix = ".//nfe:total/nfe:ICMSTot/nfe:"
+    tot = _find(total, "ICMSTot")
+    if tot is None:
+        return dict.fromkeys(_TOTALS_FIELDS)
     
+    # Um único elemento ICMSTot; cada campo é filho direto
     return {
-        "vNF": safe_float(_findtext(root, prefix + "vNF")),
-        "vProd": safe_float(_findtext(root, prefix + "vProd")),
-        "vDesc": safe_float(_findtext(root, prefix + "vDesc")),
-        "vFrete": safe_float(_findtext(root, prefix + "vFrete")),
-        "vOutro": safe_float(_findtext(root, prefix + "vOutro")),
-        "vICMS": safe_float(_findtext(root, prefix + "vICMS")),
-        "vICMSST": safe_float(_findtext(root, prefix + "vST")),
-        "vIPI": safe_float(_findtext(root, prefix + "vIPI")),
-        "vPIS": safe_float(_findtext(root, prefix + "vPIS")),
-        "vCOFINS": safe_float(_findtext(root, prefix + "vCOFINS")),
+        key: safe_float(_findtext(tot, tag))
+        for key, tag in _TOTALS_FIELDS.items()
     }
 
 
@@ -137,114 +304,227 @@ def _extract_totals(root: ET.Element) -> dict[str, Any]:
 # Extração de impostos por item
 # =============================================================================
 
-def _extract_icms_from_det(det: ET.Element) -> dict[str, Any]:
+# Tags (qualificadas) lidas no item -> chave de saída
+_TAG_PROD = _q("prod")
+_TAG_IMPOSTO = _q("imposto")
+_TAG_ICMS = _q("ICMS")
+_TAG_PIS = _q("PIS")
+_TAG_COFINS = _q("COFINS")
+
+_PROD_TAGS = {_q(k): k for k in ("cProd", "xProd", "NCM", "CFOP", "uCom", "qCom", "vUnCom", "vProd")}
+_ICMS_TAGS = {_q(k): k for k in ("CST", "CSOSN", "vBC", "vICMS")}
+_PIS_TAGS = {_q(k): k for k in ("CST", "vPIS")}
+_COFINS_TAGS = {_q(k): k for k in ("CST", "vCOFINS")}
+
+
+def _child_texts(el: ET.Element, tags: dict[str, str]) -> dict[str, str]:
     """
-    Extrai ICMS de um item (det).
+    Texto dos filhos diretos de `el` cujas tags estão em `tags`.
     
-    ICMS varia: ICMS00, ICMS10, ICMS20, ICMS40, ICMS60, ICMS90, ICMSSN101, etc.
+    Uma única passada pelos filhos; vale a primeira ocorrência de cada tag
+    e elemento vazio vira "" (mesma semântica do findtext).
     """
-    icms_parent = det.find(".//nfe:imposto/nfe:ICMS", namespaces=NFE_NS)
-    if icms_parent is None:
-        return {}
+    out: dict[str, str] = {}
+    for child in el:
+        key = tags.get(child.tag)
+        if key is not None and key not in out:
+            out[key] = child.text or ""
+    return out
+
+
+def _tax_group(parent: ET.Element | None) -> tuple[str, ET.Element] | None:
+    """Grupo do imposto (primeiro filho, ex.: ICMS00) e seu nome local."""
+    if parent is None:
+        return None
     
     # Primeiro filho é o grupo (ICMS00, ICMSSN102, etc.)
-    group = None
-    for child in list(icms_parent):
-        group = child
-        break
-    
+    group = next(iter(parent), None)
     if group is None:
-        return {}
+        return None
     
     local = group.tag.split("}", 1)[-1] if "}" in group.tag else group.tag
-    cst = group.findtext("nfe:CST", default=None, namespaces=NFE_NS)
-    csosn = group.findtext("nfe:CSOSN", default=None, namespaces=NFE_NS)
-    vBC = group.findtext("nfe:vBC", default=None, namespaces=NFE_NS)
-    vICMS = group.findtext("nfe:vICMS", default=None, namespaces=NFE_NS)
-    
-    return {
-        "icms_tipo": local,
-        "cst": cst,
-        "csosn": csosn,
-        "vBC": safe_float(vBC),
-        "vICMS": safe_float(vICMS),
-    }
+    return local, group
 
 
-def _extract_pis_from_det(det: ET.Element) -> dict[str, Any]:
-    """Extrai PIS de um item (det)."""
-    pis_parent = det.find(".//nfe:imposto/nfe:PIS", namespaces=NFE_NS)
-    if pis_parent is None:
-        return {}
+def _extract_icms(icms_parent: ET.Element | None) -> tuple | None:
+    """
+    Extrai ICMS de um item a partir do elemento <ICMS>.
     
-    group = None
-    for child in list(pis_parent):
-        group = child
-        break
+    ICMS varia: ICMS00, ICMS10, ICMS20, ICMS40, ICMS60, ICMS90, ICMSSN101, etc.
     
-    if group is None:
-        return {}
+    Returns:
+        (icms_tipo, cst, csosn, vBC, vICMS) ou None sem grupo
+    """
+    found = _tax_group(icms_parent)
+    if found is None:
+        return None
+    
+    local, group = found
+    t = _child_texts(group, _ICMS_TAGS)
+    
+    return (
+        local,
+        t.get("CST"),
+        t.get("CSOSN"),
+        safe_float(t.get("vBC")),
+        safe_float(t.get("vICMS")),
+    )
+
+
+def _extract_pis(pis_parent: ET.Element | None) -> tuple | None:
+    """Extrai PIS de um item: (pis_tipo, pis_cst, vPIS) ou None sem grupo."""
+    found = _tax_group(pis_parent)
+    if found is None:
+        return None
     
-    local = group.tag.split("}", 1)[-1] if "}" in group.tag else group.tag
-    cst = group.findtext("nfe:CST", default=None, namespaces=NFE_NS)
-    vPIS = group.findtext("nfe:vPIS", default=None, namespaces=NFE_NS)
+    local, group = found
+    t = _child_texts(group, _PIS_TAGS)
     
-    return {
-        "pis_tipo": local,
-        "pis_cst": cst,
-        "vPIS": safe_float(vPIS),
-    }
+    return (local, t.get("CST"), safe_float(t.get("vPIS")))
 
 
-def _extract_cofins_from_det(det: ET.Element) -> dict[str, Any]:
-    """Extrai COFINS de um item (det)."""
-    cof_parent = det.find(".//nfe:imposto/nfe:COFINS", namespaces=NFE_NS)
-    if cof_parent is None:
-        return {}
-    
-    group = None
-    for child in list(cof_parent):
-        group = child
-        break
+def _extract_cofins(cof_parent: ET.Element | None) -> tuple | None:
+    """Extrai COFINS de um item: (cofins_tipo, cofins_cst, vCOFINS) ou None sem grupo."""
+    found = _tax_group(cof_parent)
+    if found is None:
+        return None
     
-    if group is None:
-        return {}
+    local, group = found
+    t = _child_texts(group, _COFINS_TAGS)
     
-    local = group.tag.split("}", 1)[-1] if "}" in group.tag else group.tag
-    cst = group.findtext("nfe:CST", default=None, namespaces=NFE_NS)
-    vCOFINS = group.findtext("nfe:vCOFINS", default=None, namespaces=NFE_NS)
+    return (local, t.get("CST"), safe_float(t.get("vCOFINS")))
+
+
+# Chaves de saída de cada grupo de imposto (na ordem das tuplas acima)
+_ICMS_KEYS = ("icms_tipo", "cst", "csosn", "vBC", "vICMS")
+_PIS_KEYS = ("pis_tipo", "pis_cst", "vPIS")
+_COFINS_KEYS = ("cofins_tipo", "cofins_cst", "vCOFINS")
+
+
+@dataclass(slots=True)
+class _ItemRecord:
+    """
+    Item extraído em forma compacta (slots, impostos em tuplas).
     
-    return {
-        "cofins_tipo": local,
-        "cofins_cst": cst,
-        "vCOFINS": safe_float(vCOFINS),
-    }
+    É o que fica em memória durante o parse; o dict da API só é
+    montado por as_dict() para os itens retornados. Tratar como somente
+    leitura (não é frozen para não pagar o __setattr__ na construção).
+    """
+    nItem: int | None
+    cProd: str | None
+    xProd: str | None
+    NCM: str | None
+    CFOP: str | None
+    uCom: str | None
+    qCom: float | None
+    vUnCom: float | None
+    vProd: float | None
+    icms: tuple | None = None
+    pis: tuple | None = None
+    cofins: tuple | None = None
+    
+    def as_dict(self) -> dict[str, Any]:
+        """Dict do item no formato da API (grupo de imposto ausente não gera chaves)."""
+        item = {
+            "nItem": self.nItem,
+            "cProd": self.cProd,
+            "xProd": self.xProd,
+            "NCM": self.NCM,
+            "CFOP": self.CFOP,
+            "uCom": self.uCom,
+            "qCom": self.qCom,
+            "vUnCom": self.vUnCom,
+            "vProd": self.vProd,
+        }
+        if self.icms is not None:
+            item.update(zip(_ICMS_KEYS, self.icms))
+        if self.pis is not None:
+            item.update(zip(_PIS_KEYS, self.pis))
+        if self.cofins is not None:
+            item.update(zip(_COFINS_KEYS, self.cofins))
+        return item
+
+
+def _item_children(det: ET.Element) -> tuple[ET.Element | None, ET.Element | None]:
+    """Localiza <prod> e <imposto> de um det (filhos diretos, com fallback)."""
+    prod = imposto = None
+    for child in det:
+        tag = child.tag
+        if tag == _TAG_PROD:
+            if prod is None:
+                prod = child
+        elif tag == _TAG_IMPOSTO:
+            if imposto is None:
+                imposto = child
+    
+    # Estrutura fora do padrão: prod/imposto não são filhos diretos
+    if prod is None:
+        prod = _find(det, ".//prod")
+    if imposto is None:
+        imposto = _find(det, ".//imposto")
+    
+    return prod, imposto
+
+
+def _extract_prod(det: ET.Element, prod: ET.Element | None) -> _ItemRecord:
+    """Extrai nItem e os campos de <prod> de um item (sem impostos)."""
+    p = _child_texts(prod, _PROD_TAGS) if prod is not None else {}
+    
+    return _ItemRecord(
+        safe_int(det.attrib.get("nItem")),
+        normalize_text_or_none(p.get("cProd")),
+        normalize_text_or_none(p.get("xProd")),
+        normalize_text_or_none(p.get("NCM")),
+        normalize_text_or_none(p.get("CFOP")),
+        normalize_text_or_none(p.get("uCom")),
+        safe_float(p.get("qCom")),
+        safe_float(p.get("vUnCom")),
+        safe_float(p.get("vProd")),
+    )
 
 
-def _extract_item(det: ET.Element) -> dict[str, Any]:
-    """Extrai dados de um item (det) da NF-e."""
-    n_item = det.attrib.get("nItem")
-    
-    item = {
-        "nItem": safe_int(n_item),
-        "cProd": normalize_text_or_none(det.findtext(".//nfe:prod/nfe:cProd", default=None, namespaces=NFE_NS)),
-        "xProd": normalize_text_or_none(det.findtext(".//nfe:prod/nfe:xProd", default=None, namespaces=NFE_NS)),
-        "NCM": normalize_text_or_none(det.findtext(".//nfe:prod/nfe:NCM", default=None, namespaces=NFE_NS)),
-        "CFOP": normalize_text_or_none(det.findtext(".//nfe:prod/nfe:CFOP", default=None, namespaces=NFE_NS)),
-        "uCom": normalize_text_or_none(det.findtext(".//nfe:prod/nfe:uCom", default=None, namespaces=NFE_NS)),
-        "qCom": safe_float(det.findtext(".//nfe:prod/nfe:qCom", default=None, namespaces=NFE_NS)),
-        "vUnCom": safe_float(det.findtext(".//nfe:prod/nfe:vUnCom", default=None, namespaces=NFE_NS)),
-        "vProd": safe_float(det.findtext(".//nfe:prod/nfe:vProd", default=None, namespaces=NFE_NS)),
-    }
+def _extract_item(det: ET.Element) -> _ItemRecord:
+    """
+    Extrai dados de um item (det) da NF-e.
+    
+    Percorre os filhos de det/prod e det/imposto uma vez cada, em vez de
+    uma busca por campo.
+    """
+    prod, imposto = _item_children(det)
+    item = _extract_prod(det, prod)
     
     # Impostos por item
-    item.update(_extract_icms_from_det(det))
-    item.update(_extract_pis_from_det(det))
-    item.update(_extract_cofins_from_det(det))
+    icms = pis = cofins = None
+    if imposto is not None:
+        for child in imposto:
+            tag = child.tag
+            if tag == _TAG_ICMS:
+                if icms is None:
+                    icms = child
+            elif tag == _TAG_PIS:
+                if pis is None:
+                    pis = child
+            elif tag == _TAG_COFINS:
+                if cofins is None:
+                    cofins = child
+    
+    item.icms = _extract_icms(icms)
+    item.pis = _extract_pis(pis)
+    item.cofins = _extract_cofins(cofins)
     
     return item
 
 
+# Campos que definem a confiança do item
+_REQUIRED_ITEM_FIELDS = ("cProd", "xProd", "NCM", "CFOP", "qCom", "vUnCom", "vProd")
+
+# Confiança por quantidade de campos faltantes (0..7)
+_CONFIDENCE_BY_MISSING = tuple(
+    round(1 - (n / len(_REQUIRED_ITEM_FIELDS)), 2)
+    for n in range(len(_REQUIRED_ITEM_FIELDS) + 1)
+)
+
+
 def _confidence_for_item(item: dict[str, Any]) -> tuple[list[str], float]:
     """
     Calcula confiança da extração de um item.
@@ -252,17 +532,20 @@ def _confidence_for_item(item: dict[str, Any]) -> tuple[list[str], float]:
     Returns:
         Tupla (campos_faltantes, confiança_0_a_1)
     """
-    keys = ("cProd", "xProd", "NCM", "CFOP", "qCom", "vUnCom", "vProd")
-    missing = [k for k in keys if not item.get(k)]
-    confidence = round(1 - (len(missing) / len(keys)), 2)
-    return missing, confidence
+    get = item.get
+    missing = [k for k in _REQUIRED_ITEM_FIELDS if not get(k)]
+    return missing, _CONFIDENCE_BY_MISSING[len(missing)]
+
+
+# Valores dos campos de confiança lidos direto do registro (sem montar o dict)
+_required_values = attrgetter(*_REQUIRED_ITEM_FIELDS)
 
 
 # =============================================================================
 # Resultado da extração
 # =============================================================================
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NFeExtractResult:
     """Resultado da extração de NF-e."""
     received: bool
@@ -277,97 +560,116 @@ class NFeExtractResult:
     summary: dict[str, Any]
 
 
-def parse_nfe_xml(xml_bytes: bytes, filename: str = "upload.xml") -> NFeExtractResult:
+# Seções vazias dos resultados de falha (compartilhadas: somente leitura)
+_EMPTY: dict[str, Any] = {}
+
+
+def parse_nfe_xml(
+    xml_bytes: bytes,
+    filename: str = "upload.xml",
+    *,
+    sha256: str | None = None,
+    include_field_sources: bool = True,
+    item_range: range | None = None,
+) -> NFeExtractResult:
     """
     Faz parse de XML de NF-e.
     
     Args:
         xml_bytes: Conteúdo do XML em bytes
         filename: Nome do arquivo (para log/auditoria)
+        sha256: Hash já calculado pelo chamador (evita re-hash dos bytes)
+        include_field_sources: Se False, omite "field_sources" de cada item
+            (ex.: exportação CSV, que não usa a origem dos campos)
+        item_range: Posições (0-based) dos itens a retornar; os demais só
+            entram no sumário. count continua sendo o total de itens.
         
     Returns:
         NFeExtractResult com todos os dados extraídos
     """
-    sha256 = _sha256(xml_bytes)
-    
-    # XML vazio
+    # XML vazio (hash constante, sem passar pelo hashlib)
     if not xml_bytes:
+        if sha256 is None:
+            sha256 = _EMPTY_SHA256
         return NFeExtractResult(
             received=False,
             filename=filename,
             sha256=sha256,
             count=0,
-            header={},
-            emit={},
-            dest={},
-            totals={},
+            header=_EMPTY,
+            emit=_EMPTY,
+            dest=_EMPTY,
+            totals=_EMPTY,
             items=[],
             summary={"error": "Empty body"},
         )
     
-    # Parse do XML
+    if sha256 is None:
+        sha256 = _sha256(xml_bytes)
+    
+    # Parse do XML (streaming; itens já extraídos)
     try:
-        root = ET.fromstring(xml_bytes)
-    except ET.ParseError as exc:
+        sections, extracted = _parse_sections(xml_bytes, item_range)
+    except (ET.ParseError, XMLParseError) as exc:
         return NFeExtractResult(
             received=False,
             filename=filename,
             sha256=sha256,
             count=0,
-            header={},
-            emit={},
-            dest={},
-            totals={},
+            header=_EMPTY,
+            emit=_EMPTY,
+            dest=_EMPTY,
+            totals=_EMPTY,
             items=[],
             summary={"error": "Invalid XML or parse failure", "exception": str(exc)},
         )
     
     # Extração das seções
-    header = _extract_header(root)
-    emit = _extract_party(root, "emit")
-    dest = _extract_party(root, "dest")
-    totals = _extract_totals(root)
-    
-    # Extração dos itens
-    # Tenta múltiplos XPaths para compatibilidade com diferentes estruturas de XML
-    det_nodes = root.findall(".//nfe:NFe/nfe:infNFe/nfe:det", namespaces=NFE_NS)
-    
-    # Fallback: busca direto por det se o primeiro não encontrar
-    if not det_nodes:
-        det_nodes = root.findall(".//nfe:infNFe/nfe:det", namespaces=NFE_NS)
-    
-    # Fallback 2: busca em qualquer lugar
-    if not det_nodes:
-        det_nodes = root.findall(".//nfe:det", namespaces=NFE_NS)
+    header = _extract_header(sections)
+    emit = _extract_party(sections["emit"], "emit")
+    dest = _extract_party(sections["dest"], "dest")
+    totals = _extract_totals(sections["total"])
     
     items: list[dict[str, Any]] = []
     
     sum_vProd = 0.0
     missing_any = 0
     
-    for det in det_nodes:
-        it = _extract_item(det)
-        missing, confidence = _confidence_for_item(it)
+    for idx, rec in enumerate(extracted):
+        vProd = rec.vProd
+        if vProd is not None:
+            sum_vProd += float(vProd)
         
-        if it.get("vProd") is not None:
-            sum_vProd += float(it["vProd"])
-        if missing:
+        # Item completo (caso comum) dispensa montar a lista de faltantes
+        complete = all(_required_values(rec))
+        if not complete:
             missing_any += 1
         
-        items.append({
+        if item_range is not None and idx not in item_range:
+            continue
+        
+        it = rec.as_dict()
+        if complete:
+            missing, confidence = [], 1.0
+        else:
+            missing, confidence = _confidence_for_item(it)
+        
+        entry = {
             "item": it,
             "missing_fields": missing,
             "confidence": confidence,
             "flags": {
                 "incomplete": len(missing) > 0,
             },
-            "field_sources": {k: "xml" for k, v in it.items() if v is not None},
-        })
+        }
+        if include_field_sources:
+            entry["field_sources"] = {k: "xml" for k, v in it.items() if v is not None}
+        items.append(entry)
     
     # Sumário
     total_vProd = totals.get("vProd")
     summary = {
-        "count_items": len(items),
+        "count_items": len(extracted),
         "items_incomplete": missing_any,
         "sum_items_vProd": round(sum_vProd, 2),
         "total_vProd_xml": total_vProd,
@@ -380,7 +682,7 @@ def parse_nfe_xml(xml_bytes: bytes, filename: str = "upload.xml") -> NFeExtractR
         received=True,
         filename=filename,
         sha256=sha256,
-        count=len(items),
+        count=len(extracted),
         header=header,
         emit=emit,
         dest=dest,
@@ -395,6 +697,8 @@ def parse_nfe_xml_paged(
     filename: str,
     page: int,
     page_size: int,
+    *,
+    sha256: str | None = None,
 ) -> dict[str, Any]:
     """
     Faz parse de NF-e com paginação de itens.
@@ -404,11 +708,22 @@ def parse_nfe_xml_paged(
         filename: Nome do arquivo
         page: Número da página (1-based)
         page_size: Tamanho da página
+        sha256: Hash já calculado pelo chamador (evita re-hash dos bytes)
         
     Returns:
         Dicionário com resultado paginado
     """
-    result = parse_nfe_xml(xml_bytes=xml_bytes, filename=filename)
+    page_norm = max(1, int(page))
+    page_size_norm = max(1, min(int(page_size), 500))
+    start = (page_norm - 1) * page_size_norm
+    
+    # Só os itens da página entram no resultado (e no trabalho por item)
+    result = parse_nfe_xml(
+        xml_bytes=xml_bytes,
+        filename=filename,
+        sha256=sha256,
+        item_range=range(start, start + page_size_norm),
+    )
     
     if not result.received:
         return {
@@ -429,13 +744,10 @@ def parse_nfe_xml_paged(
         }
     
     total = result.count
-    page = max(1, int(page))
-    page_size = max(1, min(int(page_size), 500))
+    page = page_norm
+    page_size = page_size_norm
     pages = (total + page_size - 1) // page_size
-    
-    start = (page - 1) * page_size
-    end = min(start + page_size, total)
-    sliced = result.items[start:end] if start < total else []
+    sliced = result.items
     
     summary = dict(result.summary or {})
     summary["count_items"] = total
@@ -462,17 +774,64 @@ def parse_nfe_xml_paged(
 # Exportação CSV
 # =============================================================================
 
-def export_nfe_items_to_csv(items: list[dict[str, Any]]) -> str:
+def _item_rows(items: list[dict[str, Any]]):
+    """Gera as linhas do CSV de itens (uma tupla por item)."""
+    join_missing = ",".join
+    join_reasons = "|".join
+
+    for row in items:
+        it = row.get("item") or {}
+        norm = row.get("normalized") or {}
+        reasons = row.get("reasons") or []
+        get = it.get
+
+        # csv.writer grava None como campo vazio: valores numéricos vão direto
+        yield (
+            get("nItem") or "",
+            get("cProd") or "",
+            get("xProd") or "",
+            get("NCM") or "",
+            get("CFOP") or "",
+            get("uCom") or "",
+            get("qCom"),
+            get("vUnCom"),
+            get("vProd"),
+            get("icms_tipo") or "",
+            get("cst") or "",
+            get("csosn") or "",
+            get("vBC"),
+            get("vICMS"),
+            get("pis_tipo") or "",
+            get("pis_cst") or "",
+            get("vPIS"),
+            get("cofins_tipo") or "",
+            get("cofins_cst") or "",
+            get("vCOFINS"),
+            row.get("confidence"),
+            join_missing(row.get("missing_fields") or []),
+            norm.get("product_class") or "",
+            norm.get("suggested_group") or "",
+            row.get("decision") or "",
+            join_reasons([str(x) for x in reasons]),
+        )
+
+
+def export_nfe_items_to_csv(
+    items: list[dict[str, Any]],
+    out: IO[str] | None = None,
+) -> str:
     """
     Exporta itens de NF-e para CSV.
     
     Args:
         items: Lista de itens (formato do extractor)
+        out: Destino opcional (ex.: TextIOWrapper UTF-8 sobre o corpo da
+            resposta); evita montar a string inteira e codificá-la depois
         
     Returns:
-        String CSV com separador ";"
+        String CSV com separador ";" ("" quando gravado em `out`)
     """
-    output = io.StringIO()
+    output = out if out is not None else io.StringIO()
     writer = csv.writer(output, delimiter=";", lineterminator="\n")
     
     # Cabeçalho
@@ -506,39 +865,8 @@ def export_nfe_items_to_csv(items: list[dict[str, Any]]) -> str:
     ])
     
     # Dados
-    for row in items:
-        it = row.get("item", {}) or {}
-        norm = row.get("normalized", {}) or {}
-        decision = row.get("decision")
-        reasons = row.get("reasons", []) or []
-        
-        writer.writerow([
-            it.get("nItem") or "",
-            it.get("cProd") or "",
-            it.get("xProd") or "",
-            it.get("NCM") or "",
-            it.get("CFOP") or "",
-            it.get("uCom") or "",
-            it.get("qCom") if it.get("qCom") is not None else "",
-            it.get("vUnCom") if it.get("vUnCom") is not None else "",
-            it.get("vProd") if it.get("vProd") is not None else "",
-            it.get("icms_tipo") or "",
-            it.get("cst") or "",
-            it.get("csosn") or "",
-            it.get("vBC") if it.get("vBC") is not None else "",
-            it.get("vICMS") if it.get("vICMS") is not None else "",
-            it.get("pis_tipo") or "",
-            it.get("pis_cst") or "",
-            it.get("vPIS") if it.get("vPIS") is not None else "",
-            it.get("cofins_tipo") or "",
-            it.get("cofins_cst") or "",
-            it.get("vCOFINS") if it.get("vCOFINS") is not None else "",
-            row.get("confidence") if row.get("confidence") is not None else "",
-            ",".join(row.get("missing_fields", []) or []),
-            norm.get("product_class") or "",
-            norm.get("suggested_group") or "",
-            decision or "",
-            "|".join([str(x) for x in reasons]),
-        ])
+    writer.writerows(_item_rows(items))
     
+    if out is not None:
+        return ""
     return output.getvalue()
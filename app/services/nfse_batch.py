@@ -11,12 +11,18 @@ from __future__ import annotations
 
 import hashlib
 import io
+import os
 import zipfile
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from app.services.nfse_xml_extract import parse_nfse_xml_abrasf
 from app.services.nfse_service_normalizer import normalize_nfse_items
 from app.services.nfse_document_analyzer import analyze_nfse_document
+from app.utils.process_pool import map_in_pool
+
+
+# Remove a máscara do CNPJ ("12.345.678/0001-99" -> "12345678000199")
+_CNPJ_STRIP = str.maketrans("", "", "./-")
 
 
 def _sha256(data: bytes) -> str:
@@ -39,7 +45,7 @@ def _extract_prestador_from_items(items: list[dict]) -> dict[str, Any]:
     cnpj = fields.get("cnpj_fornecedor")
     
     return {
-        "doc": cnpj.replace(".", "").replace("/", "").replace("-", "") if cnpj else None,
+        "doc": cnpj.translate(_CNPJ_STRIP) if cnpj else None,
         "doc_formatado": cnpj,
         "nome": None,  # XML ABRASF não traz nome no formato atual
     }
@@ -67,41 +73,240 @@ def _extract_totals_from_summary(summary: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-def parse_nfse_zip_batch_summary(
+# A partir de quantos XMLs o lote é processado em paralelo (parse,
+# normalização e análise são CPU-bound; ver app.utils.process_pool)
+_PARALLEL_MIN_FILES = 8
+
+
+# Resultado de um XML: (entrada de files, entrada de errors, agregados do lote).
+# Agregados: (itens, valor_servicos, valor_liquido, auto, review, block,
+# missing_cnae, missing_valor, cnae_alert, liquido_divergente)
+_XmlResult = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[tuple]]
+
+
+def _process_xml(name: str, xml_bytes: bytes) -> _XmlResult:
+    """Parse + normalização + análise de um XML do lote (top-level para rodar em outro processo)."""
+    try:
+        # Parse 1 NFS-e
+        parsed = parse_nfse_xml_abrasf(xml_bytes=xml_bytes, filename=name)
+        if not parsed.received:
+            return None, {
+                "file": name,
+                "error": "parse_failed",
+                "details": parsed.summary.get("error") if parsed.summary else None
+            }, None
+
+        # Normaliza itens
+        enriched_items, norm_summary = normalize_nfse_items(parsed.items)
+
+        # Mescla summary
+        merged_summary = {
+            **(parsed.summary or {}),
+            **norm_summary,
+        }
+
+        # Extrai dados estruturados
+        prestador = _extract_prestador_from_items(parsed.items)
+        tomador = _extract_tomador_from_items(parsed.items)
+        totals = _extract_totals_from_summary(parsed.summary or {})
+
+        # Analisa documento (nível nota)
+        doc_out = analyze_nfse_document(
+            prestador=prestador,
+            tomador=tomador,
+            totals=totals,
+            summary=merged_summary,
+            enriched_items=enriched_items,
+            filial_by_tomador_doc=None,
+        )
+
+        # Adiciona document_summary ao summary
+        merged_summary["document_summary"] = doc_out.get("document_summary")
+
+        # Agregados deste arquivo para o lote
+        # parse_nfse_xml_abrasf já entrega as somas como float arredondado
+        parsed_summary = parsed.summary or {}
+        soma_serv = parsed_summary.get("sum_valor_total_politica_a") or 0.0
+        soma_liq = parsed_summary.get("sum_valor_liquido_politica_b") or 0.0
+
+        ds = norm_summary.get("decision_summary") or {}
+        qs = norm_summary.get("quality_summary") or {}
+
+        agg = (
+            int(parsed.count or 0),
+            soma_serv,
+            soma_liq,
+            int(ds.get("auto", 0) or 0),
+            int(ds.get("review", 0) or 0),
+            int(ds.get("block", 0) or 0),
+            int(qs.get("missing_cnae", 0) or 0),
+            int(qs.get("missing_valor", 0) or 0),
+            int(qs.get("cnae_alert", 0) or 0),
+            int(qs.get("liquido_divergente", 0) or 0),
+        )
+
+        # Extrai nome do arquivo sem path
+        file_basename = name.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+
+        return {
+            "file": file_basename,
+            "xml_sha256": parsed.sha256,  # já calculado no parse
+            "received": True,
+            "count_items": int(parsed.count or 0),
+            "prestador": prestador,
+            "tomador": tomador,
+            "totals": totals,
+            "summary": merged_summary,
+            "document": doc_out.get("document"),
+            "erp_projection": doc_out.get("erp_projection"),
+            "items": enriched_items,
+        }, None, agg
+
+    except Exception as exc:
+        return None, {
+            "file": name,
+            "error": "exception",
+            "exception": str(exc)
+        }, None
+
+
+def _read_members(
+    zf: zipfile.ZipFile, names: List[str], max_total_bytes: int
+) -> Iterator[Tuple[str, Optional[bytes], Optional[_XmlResult]]]:
+    """
+    Lê os XMLs do ZIP um a um: (nome, bytes, None) ou (nome, None, erro).
+
+    Para no primeiro arquivo que estoura o limite de volume descompactado.
+    """
+    decompressed_total = 0
+
+    for name in names:
+        try:
+            xml_bytes = zf.read(name)
+        except Exception as exc:
+            yield name, None, (None, {
+                "file": name,
+                "error": "exception",
+                "exception": str(exc)
+            }, None)
+            continue
+
+        decompressed_total += len(xml_bytes)
+        if decompressed_total > max_total_bytes:
+            yield name, None, (None, {
+                "file": name,
+                "error": "Batch decompressed size exceeded limit",
+                "limit_bytes": max_total_bytes
+            }, None)
+            return
+
+        yield name, xml_bytes, None
+
+
+def _iter_results_lazy(
+    zf: zipfile.ZipFile, names: List[str], max_total_bytes: int
+) -> Iterator[_XmlResult]:
+    """Lê e processa cada XML só quando o próximo resultado é pedido."""
+    for name, xml_bytes, failed in _read_members(zf, names, max_total_bytes):
+        yield failed if failed is not None else _process_xml(name, xml_bytes)
+
+
+def _iter_results_pooled(
+    zf: zipfile.ZipFile, names: List[str], max_total_bytes: int
+) -> Iterator[_XmlResult]:
+    """
+    Lê todos os XMLs antes do primeiro resultado e processa no pool.
+
+    ZipFile não é compartilhável entre processos, então os bytes de todo o
+    lote ficam em memória até o pool devolver os resultados.
+    """
+    members = list(_read_members(zf, names, max_total_bytes))
+    pending_names = [n for n, _, failed in members if failed is None]
+    pending_xmls = [x for _, x, failed in members if failed is None]
+
+    processed: Optional[Iterator[_XmlResult]] = None
+    if len(pending_xmls) >= _PARALLEL_MIN_FILES:
+        # None: pool indisponível ou quebrado (já registrado em log)
+        results_pool = map_in_pool(_process_xml, pending_names, pending_xmls)
+        if results_pool is not None:
+            processed = iter(results_pool)
+    if processed is None:
+        processed = map(_process_xml, pending_names, pending_xmls)
+
+    for _name, _xml, failed in members:
+        yield failed if failed is not None else next(processed)
+
+
+def _failed_batch_events(
+    filename: str, sha256_zip: str, error: Dict[str, Any], summary_error: str
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Eventos de um lote rejeitado antes de processar qualquer arquivo."""
+    yield "batch", {"received": False, "filename": filename, "sha256_zip": sha256_zip}
+    yield "error", error
+    yield "batch_summary", {"error": summary_error}
+
+
+def iter_nfse_zip_batch(
     zip_bytes: bytes,
     filename: str = "upload.zip",
     *,
     max_files: int = 200,
     max_total_bytes: int = 50 * 1024 * 1024,  # 50MB descompactado
-) -> Dict[str, Any]:
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
     """
-    Processa um ZIP com vários XMLs de NFS-e e retorna dados completos por arquivo.
-
-    Saída:
-      - received, filename, sha256_zip
-      - count_files_ok, count_files_error
-      - files: lista de resultados por arquivo
-      - errors: lista de erros por arquivo
-      - batch_summary: agregações do lote
+    Processa um ZIP com vários XMLs de NFS-e gerando eventos (tipo, payload).
+
+    Ordem dos eventos:
+      - ("batch", {received, filename, sha256_zip})
+      - ("file", resultado) / ("error", erro), na ordem dos arquivos do ZIP
+      - ("batch_summary", agregações do lote)
+
+    Sem o pool de processos, cada XML só é lido e processado quando o próximo
+    evento é pedido: quem consome em streaming não segura o lote inteiro em
+    memória. Lotes com _PARALLEL_MIN_FILES ou mais XMLs (e mais de um CPU)
+    vão para o pool: todos os XMLs são lidos e processados antes do primeiro
+    evento "file".
     """
     sha256_zip = _sha256(zip_bytes)
 
     if not zip_bytes:
-        return {
-            "received": False,
-            "filename": filename,
-            "sha256_zip": sha256_zip,
-            "count_files_ok": 0,
-            "count_files_error": 0,
-            "files": [],
-            "errors": [{"file": None, "error": "Empty body"}],
-            "batch_summary": {"error": "Empty body"},
-        }
+        yield from _failed_batch_events(
+            filename, sha256_zip, {"file": None, "error": "Empty body"}, "Empty body"
+        )
+        return
 
-    files_out: List[Dict[str, Any]] = []
-    errors_out: List[Dict[str, Any]] = []
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
+    except Exception as exc:
+        yield from _failed_batch_events(
+            filename,
+            sha256_zip,
+            {"file": None, "error": "Invalid zip", "exception": str(exc)},
+            "Invalid zip",
+        )
+        return
+
+    # Lista de candidatos
+    names = [n for n in zf.namelist() if _is_xml_name(n) and not n.endswith("/")]
+    names = [n for n in names if "__MACOSX" not in n]
+
+    if not names:
+        yield from _failed_batch_events(
+            filename,
+            sha256_zip,
+            {"file": None, "error": "No .xml files found in zip"},
+            "No .xml files found",
+        )
+        return
+
+    if len(names) > max_files:
+        names = names[:max_files]
+
+    yield "batch", {"received": True, "filename": filename, "sha256_zip": sha256_zip}
 
     # Agregações do lote
+    count_ok = 0
+    count_error = 0
     total_items = 0
     sum_valor_servicos = 0.0
     sum_valor_liquido = 0.0
@@ -115,147 +320,39 @@ def parse_nfse_zip_batch_summary(
     sum_cnae_alert = 0
     sum_liquido_divergente = 0
 
-    # Controle de volume descompactado
-    decompressed_total = 0
-
-    try:
-        zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
-    except Exception as exc:
-        return {
-            "received": False,
-            "filename": filename,
-            "sha256_zip": sha256_zip,
-            "count_files_ok": 0,
-            "count_files_error": 0,
-            "files": [],
-            "errors": [{"file": None, "error": "Invalid zip", "exception": str(exc)}],
-            "batch_summary": {"error": "Invalid zip"},
-        }
-
-    # Lista de candidatos
-    names = [n for n in zf.namelist() if _is_xml_name(n) and not n.endswith("/")]
-    names = [n for n in names if "__MACOSX" not in n]
+    with zf:
+        if len(names) >= _PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
+            results = _iter_results_pooled(zf, names, max_total_bytes)
+        else:
+            results = _iter_results_lazy(zf, names, max_total_bytes)
+
+        # Agrega e emite na ordem dos arquivos
+        for file_out, error, agg in results:
+            if error is not None:
+                count_error += 1
+                yield "error", error
+                continue
 
-    if not names:
-        return {
-            "received": False,
-            "filename": filename,
-            "sha256_zip": sha256_zip,
-            "count_files_ok": 0,
-            "count_files_error": 0,
-            "files": [],
-            "errors": [{"file": None, "error": "No .xml files found in zip"}],
-            "batch_summary": {"error": "No .xml files found"},
-        }
+            count_ok += 1
 
-    if len(names) > max_files:
-        names = names[:max_files]
+            total_items += agg[0]
+            sum_valor_servicos += agg[1]
+            sum_valor_liquido += agg[2]
 
-    for name in names:
-        try:
-            xml_bytes = zf.read(name)
-            decompressed_total += len(xml_bytes)
-            if decompressed_total > max_total_bytes:
-                errors_out.append({
-                    "file": name,
-                    "error": "Batch decompressed size exceeded limit",
-                    "limit_bytes": max_total_bytes
-                })
-                break
-
-            # Parse 1 NFS-e
-            parsed = parse_nfse_xml_abrasf(xml_bytes=xml_bytes, filename=name)
-            if not parsed.received:
-                errors_out.append({
-                    "file": name,
-                    "error": "parse_failed",
-                    "details": parsed.summary.get("error") if parsed.summary else None
-                })
-                continue
+            sum_dec_auto += agg[3]
+            sum_dec_review += agg[4]
+            sum_dec_block += agg[5]
 
-            # Normaliza itens
-            enriched_items, norm_summary = normalize_nfse_items(parsed.items)
-
-            # Mescla summary
-            merged_summary = {
-                **(parsed.summary or {}),
-                **norm_summary,
-            }
-
-            # Extrai dados estruturados
-            prestador = _extract_prestador_from_items(parsed.items)
-            tomador = _extract_tomador_from_items(parsed.items)
-            totals = _extract_totals_from_summary(parsed.summary or {})
-
-            # Analisa documento (nível nota)
-            doc_out = analyze_nfse_document(
-                prestador=prestador,
-                tomador=tomador,
-                totals=totals,
-                summary=merged_summary,
-                enriched_items=enriched_items,
-                filial_by_tomador_doc=None,
-            )
-
-            # Adiciona document_summary ao summary
-            merged_summary["document_summary"] = doc_out.get("document_summary")
-
-            # Agrega lote
-            total_items += int(parsed.count or 0)
-
-            valor_serv = parsed.summary.get("sum_valor_total_politica_a") if parsed.summary else None
-            valor_liq = parsed.summary.get("sum_valor_liquido_politica_b") if parsed.summary else None
-            
-            if valor_serv is not None:
-                try:
-                    sum_valor_servicos += float(valor_serv)
-                except Exception:
-                    pass
-            if valor_liq is not None:
-                try:
-                    sum_valor_liquido += float(valor_liq)
-                except Exception:
-                    pass
-
-            ds = norm_summary.get("decision_summary") or {}
-            qs = norm_summary.get("quality_summary") or {}
-
-            sum_dec_auto += int(ds.get("auto", 0) or 0)
-            sum_dec_review += int(ds.get("review", 0) or 0)
-            sum_dec_block += int(ds.get("block", 0) or 0)
-
-            sum_missing_cnae += int(qs.get("missing_cnae", 0) or 0)
-            sum_missing_valor += int(qs.get("missing_valor", 0) or 0)
-            sum_cnae_alert += int(qs.get("cnae_alert", 0) or 0)
-            sum_liquido_divergente += int(qs.get("liquido_divergente", 0) or 0)
-
-            # Extrai nome do arquivo sem path
-            file_basename = name.split("/")[-1].split("\\")[-1]
-
-            files_out.append({
-                "file": file_basename,
-                "xml_sha256": _sha256(xml_bytes),
-                "received": True,
-                "count_items": int(parsed.count or 0),
-                "prestador": prestador,
-                "tomador": tomador,
-                "totals": totals,
-                "summary": merged_summary,
-                "document": doc_out.get("document"),
-                "erp_projection": doc_out.get("erp_projection"),
-                "items": enriched_items,
-            })
+            sum_missing_cnae += agg[6]
+            sum_missing_valor += agg[7]
+            sum_cnae_alert += agg[8]
+            sum_liquido_divergente += agg[9]
 
-        except Exception as exc:
-            errors_out.append({
-                "file": name,
-                "error": "exception",
-                "exception": str(exc)
-            })
+            yield "file", file_out
 
-    batch_summary = {
-        "count_files_ok": len(files_out),
-        "count_files_error": len(errors_out),
+    yield "batch_summary", {
+        "count_files_ok": count_ok,
+        "count_files_error": count_error,
         "count_total_items": total_items,
         "sum_valor_servicos": round(sum_valor_servicos, 2),
         "sum_valor_liquido": round(sum_valor_liquido, 2),
@@ -276,12 +373,48 @@ def parse_nfse_zip_batch_summary(
         },
     }
 
+
+def parse_nfse_zip_batch_summary(
+    zip_bytes: bytes,
+    filename: str = "upload.zip",
+    *,
+    max_files: int = 200,
+    max_total_bytes: int = 50 * 1024 * 1024,  # 50MB descompactado
+) -> Dict[str, Any]:
+    """
+    Processa um ZIP com vários XMLs de NFS-e e retorna dados completos por arquivo.
+
+    Acumula os eventos de iter_nfse_zip_batch num único dict.
+
+    Saída:
+      - received, filename, sha256_zip
+      - count_files_ok, count_files_error
+      - files: lista de resultados por arquivo
+      - errors: lista de erros por arquivo
+      - batch_summary: agregações do lote
+    """
+    batch: Dict[str, Any] = {}
+    files_out: List[Dict[str, Any]] = []
+    errors_out: List[Dict[str, Any]] = []
+    batch_summary: Dict[str, Any] = {}
+
+    for kind, payload in iter_nfse_zip_batch(
+        zip_bytes, filename, max_files=max_files, max_total_bytes=max_total_bytes
+    ):
+        if kind == "file":
+            files_out.append(payload)
+        elif kind == "error":
+            errors_out.append(payload)
+        elif kind == "batch":
+            batch = payload
+        else:
+            batch_summary = payload
+
     return {
-        "received": True,
-        "filename": filename,
-        "sha256_zip": sha256_zip,
-        "count_files_ok": len(files_out),
-        "count_files_error": len(errors_out),
+        **batch,
+        # Lote rejeitado (ZIP vazio/inválido/sem XML) conta 0 e 0
+        "count_files_ok": batch_summary.get("count_files_ok", 0),
+        "count_files_error": batch_summary.get("count_files_error", 0),
         "files": files_out,
         "errors": errors_out,
         "batch_summary": batch_summary,
@@ -11,6 +11,7 @@ Responsável por:
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Any
 
 from app.core.config import settings
@@ -70,6 +71,26 @@ class NfseDocumentThresholds:
         )
 
 
+# Defaults vindos de settings: fixos durante a vida do processo, lidos uma vez
+# (cache_clear() se as configurações forem trocadas em runtime)
+
+@lru_cache(maxsize=1)
+def _default_thresholds() -> NfseDocumentThresholds:
+    """Thresholds padrão (instância frozen compartilhada)."""
+    return NfseDocumentThresholds.from_settings()
+
+
+@lru_cache(maxsize=1)
+def _default_erp_codes() -> tuple[str, str, str, str]:
+    """(movement_type, service_code_saude, service_code_tecnico, service_code_outros)."""
+    return (
+        getattr(settings, "erp_nfse_movement_type", "2.1.01"),
+        getattr(settings, "erp_service_code_saude", "00010"),
+        getattr(settings, "erp_service_code_tecnico", "00011"),
+        getattr(settings, "erp_service_code_outros", "00012"),
+    )
+
+
 # =============================================================================
 # Helpers
 # =============================================================================
@@ -79,17 +100,25 @@ def _summarize_top_reasons(reasons: list[str], max_items: int = 8) -> list[str]:
     return dedup_keep_order(reasons)[:max_items]
 
 
-def _normalize_doc_class(sc: str) -> str:
-    """Normaliza classe de serviço para comparação."""
-    s = (sc or "").strip().upper()
-    valid_classes = (
+# Classes válidas de serviço, indexadas pela forma em maiúsculas
+_VALID_DOC_CLASSES_UPPER = {
+    vc.upper(): vc
+    for vc in (
         DOC_CLASS_SAUDE, DOC_CLASS_TECNICO, DOC_CLASS_ADMIN,
         DOC_CLASS_CONSULTORIA, DOC_CLASS_MANUTENCAO, DOC_CLASS_OUTROS,
     )
-    for vc in valid_classes:
-        if s == vc.upper():
-            return vc
-    return ""
+}
+
+
+@lru_cache(maxsize=64)
+def _normalize_doc_class(sc: str) -> str:
+    """
+    Normaliza classe de serviço para comparação.
+    
+    Memoizada: o domínio é o punhado de classes que o normalizador produz.
+    """
+    s = (sc or "").strip().upper()
+    return _VALID_DOC_CLASSES_UPPER.get(s, "")
 
 
 # =============================================================================
@@ -117,7 +146,16 @@ def classify_nfse_document_from_items(
     Returns:
         Tupla (classe_documento, metadados)
     """
-    classes_seen: dict[str, int] = {
+    classes_seen = _new_classes_seen()
+    for row in enriched_items or []:
+        _count_doc_class(classes_seen, row)
+    
+    return _finalize_classification(classes_seen, majority_threshold)
+
+
+def _new_classes_seen() -> dict[str, int]:
+    """Contadores zerados por classe de serviço."""
+    return {
         DOC_CLASS_SAUDE: 0,
         DOC_CLASS_TECNICO: 0,
         DOC_CLASS_ADMIN: 0,
@@ -126,19 +164,32 @@ def classify_nfse_document_from_items(
         DOC_CLASS_OUTROS: 0,
         "UNKNOWN": 0,
     }
+
+
+def _count_doc_class(classes_seen: dict[str, int], row: Any) -> None:
+    """Contabiliza a classe de serviço normalizada de um item."""
+    norm = (row.get("normalized") or {}) if isinstance(row, dict) else {}
+    sc_raw = norm.get("service_class") or ""
+    sc = _normalize_doc_class(sc_raw)
+    
+    # _normalize_doc_class só devolve classe válida (já é chave) ou ""
+    if sc:
+        classes_seen[sc] += 1
+    elif sc_raw:
+        classes_seen[DOC_CLASS_OUTROS] += 1
+    else:
+        classes_seen["UNKNOWN"] += 1
+
+
+def _finalize_classification(
+    classes_seen: dict[str, int],
+    majority_threshold: float = 0.6,
+) -> tuple[str, dict[str, Any]]:
+    """
+    Decide a classe do documento a partir das contagens por classe.
     
-    for row in enriched_items or []:
-        norm = (row.get("normalized") or {}) if isinstance(row, dict) else {}
-        sc_raw = norm.get("service_class") or ""
-        sc = _normalize_doc_class(sc_raw)
-        
-        if sc in classes_seen:
-            classes_seen[sc] += 1
-        elif sc_raw:
-            classes_seen[DOC_CLASS_OUTROS] += 1
-        else:
-            classes_seen["UNKNOWN"] += 1
-    
+    Mesmas regras de classify_nfse_document_from_items.
+    """
     total_items = sum(classes_seen.values())
     meta = {"classes_seen": classes_seen}
     
@@ -186,10 +237,35 @@ def classify_nfse_document_from_items(
     return DOC_CLASS_MIXED, meta
 
 
+@lru_cache(maxsize=8)
+def _build_service_code_map(saude: str, tecnico: str, outros: str) -> dict[str, str]:
+    """
+    Mapa classe do documento -> código de serviço ERP.
+    
+    Memoizado pelos códigos (quase sempre os defaults de settings);
+    o dict é compartilhado, então é somente leitura.
+    """
+    return {
+        DOC_CLASS_SAUDE: saude,
+        DOC_CLASS_TECNICO: tecnico,
+        DOC_CLASS_ADMIN: outros,
+        DOC_CLASS_CONSULTORIA: outros,
+        DOC_CLASS_MANUTENCAO: outros,
+        DOC_CLASS_OUTROS: outros,
+    }
+
+
 # =============================================================================
 # Review level e texto PT-BR
 # =============================================================================
 
+# Reasons de item que contam como alerta de CNAE
+_CNAE_ALERT_REASONS = frozenset(("CNAE_VS_DESCRICAO_ALERT", "CNAE_ALERT"))
+
+# Classes de documento que sempre exigem decisão humana
+_HIGH_REVIEW_DOC_CLASSES = frozenset((DOC_CLASS_MIXED, DOC_CLASS_UNKNOWN))
+
+
 def _compute_review_level(
     *,
     missing_prestador: bool,
@@ -209,30 +285,44 @@ def _compute_review_level(
     MEDIUM: faltas ou sinais que precisam checagem
     LOW: "lançável", só validação final
     """
-    # HIGH
-    if doc_class in (DOC_CLASS_MIXED, DOC_CLASS_UNKNOWN):
-        return DOC_REVIEW_HIGH
-    if count_items == 0:
-        return DOC_REVIEW_HIGH
-    if missing_prestador or missing_valor:
-        return DOC_REVIEW_HIGH
-    if has_liquido_divergente:
+    # HIGH (checagens baratas primeiro; a classe por último)
+    if (
+        count_items == 0
+        or missing_prestador
+        or missing_valor
+        or has_liquido_divergente
+        or doc_class in _HIGH_REVIEW_DOC_CLASSES
+    ):
         return DOC_REVIEW_HIGH
     
     # MEDIUM
-    if count_incomplete > 0:
-        return DOC_REVIEW_MEDIUM
-    if items_review_high > 0:
-        return DOC_REVIEW_MEDIUM
-    if items_review_medium > 0:
-        return DOC_REVIEW_MEDIUM
-    if cnae_alerts > 0:
+    if count_incomplete > 0 or items_review_high > 0 or items_review_medium > 0 or cnae_alerts > 0:
         return DOC_REVIEW_MEDIUM
     
     # LOW
     return DOC_REVIEW_LOW
 
 
+# Texto de classificação por classe do documento
+_CLASS_TEXTS = {
+    DOC_CLASS_SAUDE: "Nota sugerida como SERVIÇO DE SAÚDE.",
+    DOC_CLASS_TECNICO: "Nota sugerida como SERVIÇO TÉCNICO.",
+    DOC_CLASS_ADMIN: "Nota sugerida como SERVIÇO ADMINISTRATIVO.",
+    DOC_CLASS_CONSULTORIA: "Nota sugerida como CONSULTORIA.",
+    DOC_CLASS_MANUTENCAO: "Nota sugerida como MANUTENÇÃO.",
+    DOC_CLASS_OUTROS: "Nota sugerida como OUTROS SERVIÇOS.",
+    DOC_CLASS_MIXED: "Nota com TIPOS DE SERVIÇO MISTURADOS (exige decisão humana).",
+}
+
+# Próximas ações comuns a toda nota (copiadas por chamada: a lista vai na saída)
+_DEFAULT_NEXT_ACTIONS = (
+    "Confirmar prestador e dados do serviço.",
+    "Verificar retenções de impostos (ISS, PIS, COFINS, IR, CSLL, INSS).",
+    "Conferir competência e datas.",
+    "Validar centro de custo conforme regras internas.",
+)
+
+
 def _build_review_text_ptbr(
     *,
     doc_class: str,
@@ -245,16 +335,7 @@ def _build_review_text_ptbr(
     base: list[str] = []
     
     # Classificação
-    class_texts = {
-        DOC_CLASS_SAUDE: "Nota sugerida como SERVIÇO DE SAÚDE.",
-        DOC_CLASS_TECNICO: "Nota sugerida como SERVIÇO TÉCNICO.",
-        DOC_CLASS_ADMIN: "Nota sugerida como SERVIÇO ADMINISTRATIVO.",
-        DOC_CLASS_CONSULTORIA: "Nota sugerida como CONSULTORIA.",
-        DOC_CLASS_MANUTENCAO: "Nota sugerida como MANUTENÇÃO.",
-        DOC_CLASS_OUTROS: "Nota sugerida como OUTROS SERVIÇOS.",
-        DOC_CLASS_MIXED: "Nota com TIPOS DE SERVIÇO MISTURADOS (exige decisão humana).",
-    }
-    base.append(class_texts.get(doc_class, "Não foi possível classificar a nota com segurança."))
+    base.append(_CLASS_TEXTS.get(doc_class, "Não foi possível classificar a nota com segurança."))
     
     # Sugestão de lançamento
     if service_code:
@@ -274,12 +355,7 @@ def _build_review_text_ptbr(
 
 def _build_next_actions_ptbr(doc_class: str) -> list[str]:
     """Gera lista de próximas ações recomendadas."""
-    actions = [
-        "Confirmar prestador e dados do serviço.",
-        "Verificar retenções de impostos (ISS, PIS, COFINS, IR, CSLL, INSS).",
-        "Conferir competência e datas.",
-        "Validar centro de custo conforme regras internas.",
-    ]
+    actions = list(_DEFAULT_NEXT_ACTIONS)
     
     if doc_class in (DOC_CLASS_MIXED, DOC_CLASS_UNKNOWN):
         actions.insert(0, "Decidir manualmente o tipo de serviço para classificação correta.")
@@ -290,6 +366,17 @@ def _build_next_actions_ptbr(doc_class: str) -> list[str]:
     return actions
 
 
+# Retenções da projeção ERP: (chave de saída, chave em summary["tax_totals"])
+_RETENCAO_KEYS = (
+    ("iss_retido", "sum_valor_iss_retido"),
+    ("pis", "sum_valor_pis"),
+    ("cofins", "sum_valor_cofins"),
+    ("inss", "sum_valor_inss"),
+    ("ir", "sum_valor_ir"),
+    ("csll", "sum_valor_csll"),
+)
+
+
 # =============================================================================
 # API Pública
 # =============================================================================
@@ -330,15 +417,16 @@ def analyze_nfse_document(
     """
     # Defaults
     if thresholds is None:
-        thresholds = NfseDocumentThresholds.from_settings()
+        thresholds = _default_thresholds()
+    default_movement, default_saude, default_tecnico, default_outros = _default_erp_codes()
     if movement_type is None:
-        movement_type = getattr(settings, "erp_nfse_movement_type", "2.1.01")
+        movement_type = default_movement
     if service_code_saude is None:
-        service_code_saude = getattr(settings, "erp_service_code_saude", "00010")
+        service_code_saude = default_saude
     if service_code_tecnico is None:
-        service_code_tecnico = getattr(settings, "erp_service_code_tecnico", "00011")
+        service_code_tecnico = default_tecnico
     if service_code_outros is None:
-        service_code_outros = getattr(settings, "erp_service_code_outros", "00012")
+        service_code_outros = default_outros
     
     reasons: list[str] = []
     
@@ -362,14 +450,8 @@ def analyze_nfse_document(
     if missing_valor:
         reasons.append(REASON_DOC_MISSING_VALOR)
     
-    # Classificação por itens
-    doc_class, class_meta = classify_nfse_document_from_items(enriched_items)
-    if doc_class == DOC_CLASS_UNKNOWN:
-        reasons.append(REASON_DOC_CANNOT_CLASSIFY)
-    if doc_class == DOC_CLASS_MIXED:
-        reasons.append(REASON_DOC_ITEMS_MIXED_CLASSES)
-    
-    # Qualidade dos itens
+    # Classificação e qualidade dos itens (uma única passada)
+    classes_seen = _new_classes_seen()
     count_item_incomplete = 0
     items_review_high = 0
     items_review_medium = 0
@@ -377,6 +459,8 @@ def analyze_nfse_document(
     has_liquido_divergente = False
     
     for row in enriched_items or []:
+        _count_doc_class(classes_seen, row)
+        
         flags = row.get("flags") or row.get("norm_flags") or {}
         if isinstance(flags, dict) and flags.get("incomplete") is True:
             count_item_incomplete += 1
@@ -388,8 +472,8 @@ def analyze_nfse_document(
             items_review_medium += 1
         
         # Verifica CNAE alerts
-        item_reasons = row.get("reasons") or []
-        if "CNAE_VS_DESCRICAO_ALERT" in item_reasons or "CNAE_ALERT" in item_reasons:
+        item_reasons = row.get("reasons")
+        if item_reasons and not _CNAE_ALERT_REASONS.isdisjoint(item_reasons):
             cnae_alerts += 1
         
         # Verifica valor líquido divergente
@@ -397,6 +481,12 @@ def analyze_nfse_document(
         if taxes.get("valor_liquido_divergente"):
             has_liquido_divergente = True
     
+    doc_class, class_meta = _finalize_classification(classes_seen)
+    if doc_class == DOC_CLASS_UNKNOWN:
+        reasons.append(REASON_DOC_CANNOT_CLASSIFY)
+    if doc_class == DOC_CLASS_MIXED:
+        reasons.append(REASON_DOC_ITEMS_MIXED_CLASSES)
+    
     if count_item_incomplete > 0:
         reasons.append(REASON_DOC_ITEMS_HAVE_INCOMPLETE)
     if items_review_high > 0:
@@ -408,7 +498,8 @@ def analyze_nfse_document(
     if has_liquido_divergente:
         reasons.append(REASON_DOC_VALOR_LIQUIDO_DIVERGENTE)
     
-    reasons = dedup_keep_order(reasons)
+    # Cada reason acima é uma constante distinta, adicionada no máximo uma
+    # vez: a lista já sai sem repetição (não precisa de dedup_keep_order)
     
     # Review level do documento
     review_level = _compute_review_level(
@@ -424,14 +515,9 @@ def analyze_nfse_document(
     )
     
     # Código de serviço sugerido
-    service_code_map = {
-        DOC_CLASS_SAUDE: service_code_saude,
-        DOC_CLASS_TECNICO: service_code_tecnico,
-        DOC_CLASS_ADMIN: service_code_outros,
-        DOC_CLASS_CONSULTORIA: service_code_outros,
-        DOC_CLASS_MANUTENCAO: service_code_outros,
-        DOC_CLASS_OUTROS: service_code_outros,
-    }
+    service_code_map = _build_service_code_map(
+        service_code_saude, service_code_tecnico, service_code_outros
+    )
     service_code = service_code_map.get(doc_class)
     
     # Projeção ERP
@@ -450,18 +536,10 @@ def analyze_nfse_document(
     # Calcula retenções
     retencoes = {}
     tax_totals = summary.get("tax_totals") or {}
-    if tax_totals.get("sum_valor_iss_retido"):
-        retencoes["iss_retido"] = tax_totals["sum_valor_iss_retido"]
-    if tax_totals.get("sum_valor_pis"):
-        retencoes["pis"] = tax_totals["sum_valor_pis"]
-    if tax_totals.get("sum_valor_cofins"):
-        retencoes["cofins"] = tax_totals["sum_valor_cofins"]
-    if tax_totals.get("sum_valor_inss"):
-        retencoes["inss"] = tax_totals["sum_valor_inss"]
-    if tax_totals.get("sum_valor_ir"):
-        retencoes["ir"] = tax_totals["sum_valor_ir"]
-    if tax_totals.get("sum_valor_csll"):
-        retencoes["csll"] = tax_totals["sum_valor_csll"]
+    for key, src in _RETENCAO_KEYS:
+        value = tax_totals.get(src)
+        if value:
+            retencoes[key] = value
     
     erp_projection = {
         "movement_type": movement_type,
@@ -1,11 +1,41 @@
 import re
-from typing import Optional, Dict, Any
+from typing import AbstractSet, Optional, Dict, Any
 
-from app.utils.regex import find_regex
+from app.utils.regex import compile_regex, find_regex
 from app.utils.money import parse_money, extract_valor_total
 from app.utils.money_scan import scan_first_money_value, scan_valor_total_by_anchor_fuzzy
 
 
+# Padrões pré-compilados (o pipeline extrai campos até 3x por documento)
+_WS_RE = re.compile(r"\s+")
+_NUM_NOTA_ANCHOR_RE = re.compile(r"(?:N[uú]mero|Numero)\s+da\s+Nota", re.IGNORECASE)
+_NUM_NOTA_DIGITS_RE = re.compile(r"[:=]?\s*([0-9]{6,})\b")
+
+_NUM_NOTA_RE = compile_regex(r"(?:N[uú]mero|Numero)\s+da\s+Nota\s*[:=]?\s*([0-9]{6,})")
+_DATA_EMISSAO_RE = compile_regex(
+    r"Data\s+e\s+Hora\s+de\s+Emiss[aã]o\s*[:=]?\s*"
+    r"([0-9]{2}/[0-9]{2}/[0-9]{4}(?:\s+[0-9]{2}:[0-9]{2}:[0-9]{2})?)"
+)
+_DATA_EMISSAO_LOOSE_RE = compile_regex(
+    r"Data\s+.*Emiss[aã]o\s*[:=]?\s*"
+    r"([0-9]{2}/[0-9]{2}/[0-9]{4}(?:\s+[0-9]{2}:[0-9]{2}:[0-9]{2})?)"
+)
+_CNPJ_ANCHORED_RE = compile_regex(
+    r"(?:CPF/CNPJ|CNPJ)\s*[:=]?\s*"
+    r"([0-9]{2}\.[0-9]{3}\.[0-9]{3}/[0-9]{4}-[0-9]{2})"
+)
+_CNPJ_BARE_RE = compile_regex(r"\b([0-9]{2}\.[0-9]{3}\.[0-9]{3}/[0-9]{4}-[0-9]{2})\b")
+# No CNPJ formatado a "/" fica sempre 10 caracteres após o início
+_CNPJ_SLASH_OFFSET = 10
+# Com IGNORECASE, "COMPET[EÊ]NCIA" já cobre "COMPETENCIA"/"Competência" e
+# "VALOR TOTAL DA NOTA" cobre "Valor Total da Nota": um padrão por campo
+_COMPETENCIA_RE = compile_regex(r"COMPET[EÊ]NCIA\s*[:=]?\s*([0-9]{2}/[0-9]{4})")
+_VALOR_ANCHORED_RE = compile_regex(
+    r"VALOR\s+TOTAL\s+DA\s+NOTA\s*[:=]?\s*R?\$?\s*"
+    r"([0-9]{1,3}(?:\.[0-9]{3})*,[0-9]{2}|[0-9]+,[0-9]{2})"
+)
+
+
 def extract_numero_nota(source_text: str) -> Optional[str]:
     """
     Extrai número da nota por âncora 'Número da Nota' e captura dígitos após.
@@ -13,68 +43,90 @@ def extract_numero_nota(source_text: str) -> Optional[str]:
       - exige pelo menos 6 dígitos (evita capturar '2025' como nota).
       - NFSe costuma vir com zeros à esquerda (ex.: 00000820).
     """
-    text = re.sub(r"\s+", " ", source_text)
-
-    anchor = re.search(r"(?:N[uú]mero|Numero)\s+da\s+Nota", text, re.IGNORECASE)
+    # A âncora já aceita \s+ entre as palavras: acha a mesma ocorrência no
+    # texto cru, sem colapsar os espaços do texto inteiro
+    anchor = _NUM_NOTA_ANCHOR_RE.search(source_text)
     if not anchor:
         return None
 
-    window = text[anchor.end() : anchor.end() + 140]
+    # Janela: 140 caracteres após a âncora, com espaços colapsados. Só o
+    # trecho necessário é normalizado (dobra até render 140 ou acabar o texto)
+    start = anchor.end()
+    size = 256
+    while True:
+        chunk = source_text[start : start + size]
+        window = _WS_RE.sub(" ", chunk)
+        if len(window) >= 140 or len(chunk) < size:
+            break
+        size *= 2
 
     # Exige 6+ dígitos (evita ano "2025")
-    m = re.search(r"[:=]?\s*([0-9]{6,})\b", window)
+    m = _NUM_NOTA_DIGITS_RE.search(window, 0, 140)
     if not m:
         return None
 
     return m.group(1).strip()
 
 
-def extract_nfse_fields(source_text: str) -> Dict[str, Any]:
+def _find_cnpj_bare(source_text: str) -> Optional[str]:
+    """
+    Primeiro CNPJ formatado sem âncora. Em vez de varrer o texto inteiro com
+    a regex, só tenta casar nas posições das barras (str.find, em C).
+    """
+    idx = source_text.find("/", _CNPJ_SLASH_OFFSET)
+    while idx != -1:
+        m = _CNPJ_BARE_RE.match(source_text, idx - _CNPJ_SLASH_OFFSET)
+        if m:
+            return m.group(1)
+        idx = source_text.find("/", idx + 1)
+    return None
+
+
+def extract_nfse_fields(
+    source_text: str,
+    fields_needed: Optional[AbstractSet[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Extrai os campos da NFS-e do texto (PDF ou OCR).
+
+    fields_needed: se informado, só esses campos são procurados; os demais
+    voltam None (usado nas passadas de OCR, que só completam o que falta).
+    """
+    numero_nota = data_emissao = cnpj_fornecedor = competencia = valor_total = None
+
+    # Sondas baratas antes das regex: sem a palavra-âncora no texto a regex
+    # (IGNORECASE) não tem como casar. Comum nas passadas de OCR.
+    text_up = source_text.upper()
+
     # ---------------------------
     # Número da Nota
     # ---------------------------
-    numero_nota = find_regex(
-        r"(?:N[uú]mero|Numero)\s+da\s+Nota\s*[:=]?\s*([0-9]{6,})",
-        source_text,
-    )
-    if not numero_nota:
-        numero_nota = extract_numero_nota(source_text)
+    if (fields_needed is None or "numero_nota" in fields_needed) and "NOTA" in text_up:
+        numero_nota = find_regex(_NUM_NOTA_RE, source_text)
+        if not numero_nota:
+            numero_nota = extract_numero_nota(source_text)
 
     # ---------------------------
     # Data e Hora de Emissão
     # ---------------------------
-    data_emissao = find_regex(
-        r"Data\s+e\s+Hora\s+de\s+Emiss[aã]o\s*[:=]?\s*"
-        r"([0-9]{2}/[0-9]{2}/[0-9]{4}(?:\s+[0-9]{2}:[0-9]{2}:[0-9]{2})?)",
-        source_text,
-    ) or find_regex(
-        r"Data\s+.*Emiss[aã]o\s*[:=]?\s*"
-        r"([0-9]{2}/[0-9]{2}/[0-9]{4}(?:\s+[0-9]{2}:[0-9]{2}:[0-9]{2})?)",
-        source_text,
-    )
+    if (fields_needed is None or "data_emissao" in fields_needed) and "DATA" in text_up:
+        data_emissao = find_regex(_DATA_EMISSAO_RE, source_text) or find_regex(
+            _DATA_EMISSAO_LOOSE_RE, source_text
+        )
 
     # ---------------------------
     # CNPJ Prestador (Fornecedor)
     # ---------------------------
-    cnpj_fornecedor = find_regex(
-        r"(?:CPF/CNPJ|CNPJ)\s*[:=]?\s*"
-        r"([0-9]{2}\.[0-9]{3}\.[0-9]{3}/[0-9]{4}-[0-9]{2})",
-        source_text,
-    ) or find_regex(
-        r"\b([0-9]{2}\.[0-9]{3}\.[0-9]{3}/[0-9]{4}-[0-9]{2})\b",
-        source_text,
-    )
+    if (fields_needed is None or "cnpj_fornecedor" in fields_needed) and "/" in source_text:
+        cnpj_fornecedor = find_regex(_CNPJ_ANCHORED_RE, source_text) or _find_cnpj_bare(
+            source_text
+        )
 
     # ---------------------------
     # Competência
     # ---------------------------
-    competencia = find_regex(
-        r"COMPET[EÊ]NCIA\s*[:=]?\s*([0-9]{2}/[0-9]{4})",
-        source_text,
-    ) or find_regex(
-        r"COMPETENCIA\s*[:=]?\s*([0-9]{2}/[0-9]{4})",
-        source_text,
-    )
+    if (fields_needed is None or "competencia" in fields_needed) and "COMPET" in text_up:
+        competencia = find_regex(_COMPETENCIA_RE, source_text)
 
     # ---------------------------
     # Valor total (robusto)
@@ -84,28 +136,23 @@ def extract_nfse_fields(source_text: str) -> Dict[str, Any]:
     #  3) âncora fuzzy (tolerante a OCR)
     #  4) scan monetário global (último recurso sem crop)
     # ---------------------------
-    valor_total_raw = find_regex(
-        r"VALOR\s+TOTAL\s+DA\s+NOTA\s*[:=]?\s*R?\$?\s*"
-        r"([0-9]{1,3}(?:\.[0-9]{3})*,[0-9]{2}|[0-9]+,[0-9]{2})",
-        source_text,
-    ) or find_regex(
-        r"Valor\s+Total\s+da\s+Nota\s*[:=]?\s*R?\$?\s*"
-        r"([0-9]{1,3}(?:\.[0-9]{3})*,[0-9]{2}|[0-9]+,[0-9]{2})",
-        source_text,
-    )
-
-    valor_total = parse_money(valor_total_raw)
-
-    if valor_total is None:
-        valor_total = extract_valor_total(source_text)
-
-    if valor_total is None:
-        valor_total = scan_valor_total_by_anchor_fuzzy(source_text)
-
-    if valor_total is None:
-        # Se a nota tiver vários valores, esse fallback pode pegar outro.
-        # Por isso ele fica depois das tentativas com âncora.
-        valor_total = scan_first_money_value(source_text)
+    if fields_needed is None or "valor_total" in fields_needed:
+        valor_total_raw = None
+        if "VALOR" in text_up:
+            valor_total_raw = find_regex(_VALOR_ANCHORED_RE, source_text)
+
+        valor_total = parse_money(valor_total_raw)
+
+        if valor_total is None:
+            valor_total = extract_valor_total(source_text)
+
+        if valor_total is None:
+            valor_total = scan_valor_total_by_anchor_fuzzy(source_text)
+
+        if valor_total is None:
+            # Se a nota tiver vários valores, esse fallback pode pegar outro.
+            # Por isso ele fica depois das tentativas com âncora.
+            valor_total = scan_first_money_value(source_text)
 
     return {
         "numero_nota": numero_nota,
@@ -3,7 +3,10 @@ from __future__ import annotations
 import hashlib
 import logging
 import os
-from typing import Dict, Any, Tuple, Optional
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Tuple, Optional, Sequence
 
 from app.utils.payload import normalize_pdf_payload
 from app.services.pdf_text import extract_text_with_pdfplumber
@@ -28,38 +31,37 @@ def _compute_confidence(fields: Dict[str, Any]) -> Tuple[list[str], float]:
     return missing, confidence
 
 
-def _missing_critical(fields: Dict[str, Any]) -> list[str]:
-    return [k for k in CRITICAL_FIELDS if not fields.get(k)]
-
-
-def _merge_sources(base: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+def _missing_critical(fields: Dict[str, Any], keys: Sequence[str] = CRITICAL_FIELDS) -> list[str]:
     """
-    Merge de campos: usa valores novos apenas quando forem "melhores" (não None).
+    Campos críticos vazios. Entre etapas basta passar o que faltava antes:
+    o merge nunca esvazia um campo já preenchido.
     """
-    merged = dict(base)
-    for k, v in update.items():
-        if merged.get(k) is None and v is not None:
-            merged[k] = v
-    return merged
+    return [k for k in keys if not fields.get(k)]
 
 
-def _source_map_for_update(
-    previous_fields: Dict[str, Any],
+def _merge_in_place(
+    fields: Dict[str, Any],
     new_fields: Dict[str, Any],
     source_name: str,
     field_sources: Dict[str, str],
 ) -> None:
     """
-    Marca origem do campo quando ele foi preenchido agora (antes era None e agora não é).
+    Merge de campos: usa valores novos apenas quando forem "melhores" (não None),
+    e marca a origem do campo preenchido agora (antes era None e agora não é).
     """
     for k, v in new_fields.items():
-        if previous_fields.get(k) is None and v is not None:
+        if v is not None and fields.get(k) is None:
+            fields[k] = v
             field_sources[k] = source_name
 
 
+@lru_cache(maxsize=8)
 def _parse_crop_env(var_name: str) -> Optional[Tuple[float, float, float, float]]:
     """
     Espera 'x0,y0,x1,y1' em points do PDF. Ex.: '0,420,595,520'
+
+    Lido uma vez por variável, como as settings (get_settings também é
+    cacheado); _parse_crop_env.cache_clear() relê o ambiente.
     """
     raw = os.getenv(var_name)
     if not raw:
@@ -73,6 +75,40 @@ def _parse_crop_env(var_name: str) -> Optional[Tuple[float, float, float, float]
         return None
 
 
+@lru_cache(maxsize=1)
+def _ocr_parallel_enabled() -> bool:
+    """NFSE_OCR_PARALLEL=1 roda o OCR principal em paralelo com o do header."""
+    return os.getenv("NFSE_OCR_PARALLEL", "").strip() == "1"
+
+
+# Pool para o OCR principal antecipado (o Tesseract roda em subprocesso,
+# então as duas passadas se sobrepõem de fato). Limite fixo: cada worker
+# dispara um Tesseract, que já usa vários núcleos sozinho
+_OCR_MAX_WORKERS = 2
+
+_ocr_executor: Optional[ThreadPoolExecutor] = None
+_ocr_executor_lock = threading.Lock()
+
+
+def _get_ocr_executor() -> ThreadPoolExecutor:
+    """Pool de threads compartilhado, criado sob demanda."""
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is None:
+            _ocr_executor = ThreadPoolExecutor(max_workers=_OCR_MAX_WORKERS)
+        return _ocr_executor
+
+
+def _ocr_main(pdf_bytes: bytes) -> Tuple[int, str]:
+    """OCR principal (página inteira) da 1ª página."""
+    return ocr_pdf_with_tesseract(
+        pdf_bytes,
+        lang="por+eng",
+        config="--oem 3 --psm 6",
+        only_first_page=True,
+    )
+
+
 def run_nfse_extract_pipeline(raw: bytes, filename: str = "upload.pdf") -> Dict[str, Any]:
     if not raw:
         return {"received": False, "error": "Empty body"}
@@ -108,6 +144,15 @@ def run_nfse_extract_pipeline(raw: bytes, filename: str = "upload.pdf") -> Dict[
     ocr_header_crop = _parse_crop_env("OCR_HEADER_CROP")
     ocr_valor_crop = _parse_crop_env("OCR_VALOR_CROP")
 
+    # Com NFSE_OCR_PARALLEL=1 o OCR principal começa junto com o do header;
+    # o resultado só é usado se a etapa 3 rodaria de qualquer forma
+    ocr_main_future: Optional[Future] = None
+    if missing_crit and _ocr_parallel_enabled():
+        try:
+            ocr_main_future = _get_ocr_executor().submit(_ocr_main, pdf_bytes)
+        except Exception:
+            ocr_main_future = None
+
     # --------
     # 2) OCR header-first
     # --------
@@ -122,33 +167,35 @@ def run_nfse_extract_pipeline(raw: bytes, filename: str = "upload.pdf") -> Dict[
             )
             debug["steps"].append({"stage": "ocr_header", "crop": ocr_header_crop, "chars": len(text_ocr_header)})
 
-            fields_hdr = extract_nfse_fields(text_ocr_header)
-            _source_map_for_update(fields, fields_hdr, "ocr_header", field_sources)
-            fields = _merge_sources(fields, fields_hdr)
+            # Só procura o que ainda falta (o merge não sobrescreve o resto)
+            fields_hdr = extract_nfse_fields(text_ocr_header, frozenset(missing_crit))
+            _merge_in_place(fields, fields_hdr, "ocr_header", field_sources)
 
-            missing_crit = _missing_critical(fields)
+            missing_crit = _missing_critical(fields, missing_crit)
             if method == "pdf_text":
                 method = "pdf_text+ocr_header"
         except Exception as exc:
             logger.warning("OCR header failed | file=%s | err=%s", filename, exc)
             debug["steps"].append({"stage": "ocr_header_failed", "err": str(exc)})
 
+    # Header completou os críticos: o OCR principal antecipado não será usado
+    # (se ainda estiver na fila, nem começa; se já começou, o resultado é descartado)
+    if ocr_main_future is not None and not missing_crit:
+        ocr_main_future.cancel()
+
     # --------
     # 3) OCR main (fallback pesado) — 1ª página (MVP barato)
     # --------
     if missing_crit:
         try:
-            ocr_pages_main, text_ocr_main = ocr_pdf_with_tesseract(
-                pdf_bytes,
-                lang="por+eng",
-                config="--oem 3 --psm 6",
-                only_first_page=True,
-            )
+            if ocr_main_future is not None:
+                ocr_pages_main, text_ocr_main = ocr_main_future.result()
+            else:
+                ocr_pages_main, text_ocr_main = _ocr_main(pdf_bytes)
             debug["steps"].append({"stage": "ocr_main_first_page", "pages": ocr_pages_main, "chars": len(text_ocr_main)})
 
-            fields_main = extract_nfse_fields(text_ocr_main)
-            _source_map_for_update(fields, fields_main, "ocr_main", field_sources)
-            fields = _merge_sources(fields, fields_main)
+            fields_main = extract_nfse_fields(text_ocr_main, frozenset(missing_crit))
+            _merge_in_place(fields, fields_main, "ocr_main", field_sources)
 
             pages = max(pages, ocr_pages_main)
 
@@ -11,10 +11,12 @@ Responsável por:
 """
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Any
 
 from app.core.config import settings
 from app.services.cnae_rules import validate_cnae_vs_descricao
+from app.utils.converters import digits_only
 
 
 # =============================================================================
@@ -116,40 +118,83 @@ CNAE_MANUTENCAO_PREFIXES = (
 )
 
 
+def _build_cnae_rules() -> dict[str, tuple[int, str, str]]:
+    """
+    Prefixo -> (prioridade, classe, reason).
+    
+    Equivale a testar startswith nas tuplas acima na ordem das classes,
+    já que cnae[:len(prefixo)] == prefixo.
+    """
+    rules: dict[str, tuple[int, str, str]] = {}
+    groups = (
+        (CNAE_SAUDE_PREFIXES, CLASS_SAUDE, REASON_CLASS_SAUDE_BY_CNAE),
+        (CNAE_TECNICO_PREFIXES, CLASS_TECNICO, REASON_CLASS_TECNICO_BY_CNAE),
+        (CNAE_CONSULTORIA_PREFIXES, CLASS_CONSULTORIA, REASON_CLASS_CONSULTORIA_BY_CNAE),
+        (CNAE_ADMIN_PREFIXES, CLASS_ADMIN, REASON_CLASS_ADMIN_BY_CNAE),
+        (CNAE_MANUTENCAO_PREFIXES, CLASS_MANUTENCAO, REASON_CLASS_MANUTENCAO_BY_CNAE),
+    )
+    for priority, (prefixes, service_class, reason) in enumerate(groups):
+        for prefix in prefixes:
+            rules.setdefault(prefix, (priority, service_class, reason))
+    return rules
+
+
+_CNAE_RULES = _build_cnae_rules()
+_CNAE_PREFIX_LENGTHS = tuple(sorted({len(p) for p in _CNAE_RULES}))
+
+
 # =============================================================================
 # Keywords para classificação por descrição
 # =============================================================================
 
-KEYWORDS_SAUDE = [
+KEYWORDS_SAUDE = (
     "MEDIC", "HOSPITAL", "CLINIC", "SAUDE", "SAÚDE", "ENFERM", "CIRURG",
     "CONSULT", "HONOR", "ATENDIMENTO", "PACIENTE", "EXAME", "DIAGNOS",
     "TERAPIA", "TRATAMENTO", "FISIO", "ODONTO", "PSICO", "NUTRI",
     "LABOR", "PATOLOG", "RADIOLOG", "ULTRASSOM", "TOMOGRAF",
-]
+)
 
-KEYWORDS_TECNICO = [
+KEYWORDS_TECNICO = (
     "SISTEMA", "SOFTWARE", "PROGRAMA", "DESENVOLV", "T.I.", "TI ",
     "INFORMATIC", "TECNOLOG", "SUPORTE", "REDE", "SERVIDOR",
     "ENGENHAR", "ARQUITET", "PROJETO", "LAUDO", "VISTORIA",
     "PESQUISA", "PUBLICIDADE", "MARKETING", "DESIGN",
-]
+)
 
-KEYWORDS_CONSULTORIA = [
+KEYWORDS_CONSULTORIA = (
     "CONSULTORIA", "ASSESSORIA", "PLANEJAMENTO", "GESTAO", "GESTÃO",
     "ESTRATEG", "ANALISE", "ANÁLISE", "DIAGNÓSTICO", "PARECER",
     "ORIENT", "COACHING", "MENTORIA", "TREINAMENTO",
-]
+)
 
-KEYWORDS_ADMIN = [
+KEYWORDS_ADMIN = (
     "ADMINISTRAT", "ESCRITORIO", "ESCRITÓRIO", "SECRETAR", "RECEP",
     "VIGILANCIA", "VIGILÂNCIA", "SEGURANÇA", "LIMPEZA", "CONSERV",
     "PORTARIA", "ZELADORIA", "COPEIRA", "TERCEIRIZ",
-]
+)
 
-KEYWORDS_MANUTENCAO = [
+KEYWORDS_MANUTENCAO = (
     "MANUTENCAO", "MANUTENÇÃO", "REPARO", "CONSERTO", "INSTALAC",
     "REVISAO", "REVISÃO", "PREVENTIV", "CORRETIV", "ASSISTENCIA",
-]
+)
+
+# Todas as keywords numa única tabela (keyword, classe, reason), na ordem de
+# prioridade das classes: um laço simples de `in` em vez de um any() com
+# gerador por classe
+_KEYWORD_RULES = tuple(
+    (keyword, service_class, reason)
+    for keywords, service_class, reason in (
+        (KEYWORDS_SAUDE, CLASS_SAUDE, REASON_CLASS_SAUDE_BY_KEYWORD),
+        (KEYWORDS_TECNICO, CLASS_TECNICO, REASON_CLASS_TECNICO_BY_KEYWORD),
+        (KEYWORDS_CONSULTORIA, CLASS_CONSULTORIA, REASON_CLASS_CONSULTORIA_BY_KEYWORD),
+        (KEYWORDS_ADMIN, CLASS_ADMIN, REASON_CLASS_ADMIN_BY_KEYWORD),
+        (KEYWORDS_MANUTENCAO, CLASS_MANUTENCAO, REASON_CLASS_MANUTENCAO_BY_KEYWORD),
+    )
+    for keyword in keywords
+)
+
+# Descrição mais curta que a menor keyword não casa nenhuma: pula a varredura
+_KEYWORD_MIN_LEN = min(len(keyword) for keyword, _, _ in _KEYWORD_RULES)
 
 
 # =============================================================================
@@ -183,89 +228,58 @@ def _classify_by_cnae_and_keywords(
     Returns:
         Tupla (classe, lista de reasons)
     """
-    reasons: list[str] = []
-    
+    service_class, reason = _classify_cached(cnae, descricao)
+    return service_class, [reason]
+
+
+@lru_cache(maxsize=1024)
+def _classify_cached(cnae: str | None, descricao: str | None) -> tuple[str, str]:
+    """
+    Núcleo de _classify_by_cnae_and_keywords: (classe, reason).
+
+    Memoizado: num lote os itens repetem CNAE e descrição do mesmo
+    prestador, e a varredura de keywords é o trecho caro.
+    """
     # Extrai apenas dígitos do CNAE
-    cnae_digits = "".join(c for c in (cnae or "") if c.isdigit())
-    
-    # Descrição em maiúsculas para comparação
-    desc_up = (descricao or "").upper()
+    cnae_digits = digits_only(cnae)
     
     # ========================================================================
     # 1) Classificação por CNAE
     # ========================================================================
     
-    # SAÚDE
-    for prefix in CNAE_SAUDE_PREFIXES:
-        if cnae_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_SAUDE_BY_CNAE)
-            return CLASS_SAUDE, reasons
-    
-    # TÉCNICO
-    for prefix in CNAE_TECNICO_PREFIXES:
-        if cnae_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_TECNICO_BY_CNAE)
-            return CLASS_TECNICO, reasons
-    
-    # CONSULTORIA
-    for prefix in CNAE_CONSULTORIA_PREFIXES:
-        if cnae_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_CONSULTORIA_BY_CNAE)
-            return CLASS_CONSULTORIA, reasons
-    
-    # ADMINISTRATIVO
-    for prefix in CNAE_ADMIN_PREFIXES:
-        if cnae_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_ADMIN_BY_CNAE)
-            return CLASS_ADMIN, reasons
-    
-    # MANUTENÇÃO
-    for prefix in CNAE_MANUTENCAO_PREFIXES:
-        if cnae_digits.startswith(prefix):
-            reasons.append(REASON_CLASS_MANUTENCAO_BY_CNAE)
-            return CLASS_MANUTENCAO, reasons
+    # Um get por tamanho de prefixo; vence a classe de maior prioridade
+    best = None
+    for length in _CNAE_PREFIX_LENGTHS:
+        rule = _CNAE_RULES.get(cnae_digits[:length])
+        if rule is not None and (best is None or rule[0] < best[0]):
+            best = rule
+    if best is not None:
+        return best[1], best[2]
     
     # ========================================================================
     # 2) Classificação por keywords na descrição
     # ========================================================================
     
-    # SAÚDE
-    if any(k in desc_up for k in KEYWORDS_SAUDE):
-        reasons.append(REASON_CLASS_SAUDE_BY_KEYWORD)
-        return CLASS_SAUDE, reasons
-    
-    # TÉCNICO
-    if any(k in desc_up for k in KEYWORDS_TECNICO):
-        reasons.append(REASON_CLASS_TECNICO_BY_KEYWORD)
-        return CLASS_TECNICO, reasons
+    # Descrição em maiúsculas só quando o CNAE não decidiu e há descrição
+    desc_up = descricao.upper() if descricao else ""
     
-    # CONSULTORIA
-    if any(k in desc_up for k in KEYWORDS_CONSULTORIA):
-        reasons.append(REASON_CLASS_CONSULTORIA_BY_KEYWORD)
-        return CLASS_CONSULTORIA, reasons
-    
-    # ADMINISTRATIVO
-    if any(k in desc_up for k in KEYWORDS_ADMIN):
-        reasons.append(REASON_CLASS_ADMIN_BY_KEYWORD)
-        return CLASS_ADMIN, reasons
-    
-    # MANUTENÇÃO
-    if any(k in desc_up for k in KEYWORDS_MANUTENCAO):
-        reasons.append(REASON_CLASS_MANUTENCAO_BY_KEYWORD)
-        return CLASS_MANUTENCAO, reasons
+    # Tabela na ordem de prioridade: a primeira keyword encontrada decide
+    if len(desc_up) >= _KEYWORD_MIN_LEN:
+        for keyword, service_class, reason in _KEYWORD_RULES:
+            if keyword in desc_up:
+                return service_class, reason
     
     # ========================================================================
     # 3) Fallback
     # ========================================================================
-    reasons.append(REASON_CLASS_OUTROS_FALLBACK)
-    return CLASS_OUTROS, reasons
+    return CLASS_OUTROS, REASON_CLASS_OUTROS_FALLBACK
 
 
 def _get_cnae_group(cnae: str | None) -> str | None:
     """Retorna o grupo do CNAE (2 primeiros dígitos)."""
     if not cnae:
         return None
-    digits = "".join(c for c in cnae if c.isdigit())
+    digits = digits_only(cnae)
     return digits[:2] if len(digits) >= 2 else None
 
 
@@ -380,7 +394,6 @@ def normalize_nfse_item(
         - review_text_ptbr: explicação
     """
     reasons: list[str] = []
-    norm_flags: dict[str, Any] = {}
     
     # Extrai campos do formato do extrator
     fields = item.get("fields") or {}
@@ -426,17 +439,18 @@ def normalize_nfse_item(
     if taxes.get("valor_liquido_divergente"):
         reasons.append(REASON_VALOR_LIQUIDO_DIVERGENTE)
     
-    # Flags do extrator
-    norm_flags["missing_critical"] = flags.get("missing_critical", False)
-    norm_flags["incomplete"] = flags.get("incomplete", False)
-    norm_flags["needs_review"] = flags.get("needs_review", False)
-    
-    # Flags adicionais
-    norm_flags["has_minimum_fields"] = bool(numero_nota and cnpj_fornecedor and valor_total)
-    norm_flags["has_valid_cnae"] = bool(cnae) and cnae_status != "alert"
-    norm_flags["has_valid_valor"] = valor_total is not None and valor_total > 0
-    norm_flags["valor_liquido_divergente"] = taxes.get("valor_liquido_divergente", False)
-    norm_flags["requires_review_cnae"] = cnae_status in ("alert", "unknown")
+    norm_flags: dict[str, Any] = {
+        # Flags do extrator
+        "missing_critical": flags.get("missing_critical", False),
+        "incomplete": flags.get("incomplete", False),
+        "needs_review": flags.get("needs_review", False),
+        # Flags adicionais
+        "has_minimum_fields": bool(numero_nota and cnpj_fornecedor and valor_total),
+        "has_valid_cnae": bool(cnae) and cnae_status != "alert",
+        "has_valid_valor": valor_total is not None and valor_total > 0,
+        "valor_liquido_divergente": taxes.get("valor_liquido_divergente", False),
+        "requires_review_cnae": cnae_status in ("alert", "unknown"),
+    }
     
     # Classificação
     service_class, class_reasons = _classify_by_cnae_and_keywords(cnae, descricao)
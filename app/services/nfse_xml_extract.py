@@ -7,25 +7,26 @@ import re
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple
 from app.services.cnae_rules import validate_cnae_vs_descricao
 from app.services.decision import decide_for_erp_from_xml_item
+from app.utils.converters import digits_only_or_none
 
 
 
 
 ABRASF_NS = {"nfse": "http://www.abrasf.org.br/ABRASF/arquivos/nfse.xsd"}
 
+_WS_RE = re.compile(r"\s+")
+
 
 def _sha256(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
 
 def _digits_only(s: Optional[str]) -> Optional[str]:
-    if not s:
-        return None
-    d = re.sub(r"\D+", "", s)
-    return d or None
+    return digits_only_or_none(s)
 
 
 def _fmt_cnpj_mask(digits: Optional[str]) -> Optional[str]:
@@ -104,7 +105,7 @@ def _guess_descricao_servico(discriminacao: Optional[str]) -> str:
     d_upper = d.upper()
     if "HONOR" in d_upper:
         return "honorarios medicos"
-    resumo = re.sub(r"\s+", " ", d)[:120].strip()
+    resumo = _WS_RE.sub(" ", d)[:120].strip()
     return resumo if resumo else "servico"
 
 
@@ -124,31 +125,52 @@ def _confidence_for_item(fields: Dict[str, Any]) -> Tuple[List[str], float]:
     return missing, confidence
 
 
-def _findtext(comp: ET.Element, xpath: str) -> Optional[str]:
+_NFSE_PREFIX = "{" + ABRASF_NS["nfse"] + "}"
+
+
+@lru_cache(maxsize=512)
+def _compile_xpath(xpath: str) -> Tuple[str, str, str, str]:
+    """
+    Pré-processa um xpath de _findtext uma vez por caminho.
+
+    Retorna (caminho com namespace em notação Clark, caminho sem namespace,
+    nome local final, sufixo "}nome" para casar tags com namespace).
+    Com a tag já qualificada o findtext não resolve o prefixo "nfse:" a
+    cada chamada.
+    """
+    no_ns = xpath.replace("nfse:", "")
+    local = no_ns.split("/")[-1]
+    return xpath.replace("nfse:", _NFSE_PREFIX), no_ns, local, "}" + local
+
+
+def _findtext(comp: ET.Element, xpath: str, scan_local: bool = True) -> Optional[str]:
     """
     Tenta encontrar texto usando XPath com namespace, fallback para local-name.
+
+    scan_local=False pula a tentativa 3 (usado por _findtext_multi quando o
+    mesmo nome local já foi varrido sem sucesso).
     """
+    ns_path, no_ns_path, last_part, ns_suffix = _compile_xpath(xpath)
+
     # Tentativa 1: com namespace ABRASF
-    result = comp.findtext(xpath, default=None, namespaces=ABRASF_NS)
-    if result:
-        return result
+    # (caminho sem "nfse:" é igual ao da tentativa 2: não repete a busca)
+    if ns_path != no_ns_path:
+        result = comp.findtext(ns_path)
+        if result:
+            return result
     
-    # Tentativa 2: extrair elementos do xpath e buscar sem namespace
+    # Tentativa 2: elementos do xpath sem namespace
     # Ex: ".//nfse:InfNfse/nfse:Numero" -> ".//InfNfse/Numero"
-    xpath_no_ns = xpath.replace("nfse:", "")
-    result = comp.findtext(xpath_no_ns, default=None)
+    result = comp.findtext(no_ns_path)
     if result:
         return result
     
     # Tentativa 3: buscar pelo último elemento do xpath usando iter
     # Ex: ".//nfse:Servico/nfse:Valores/nfse:ValorServicos" -> busca ValorServicos
-    parts = xpath.split("/")
-    if parts:
-        last_part = parts[-1].replace("nfse:", "")
+    if scan_local:
         for el in comp.iter():
             tag = el.tag
-            local = tag.split("}", 1)[-1] if "}" in tag else tag
-            if local == last_part:
+            if tag == last_part or tag.endswith(ns_suffix):
                 if el.text and el.text.strip():
                     return el.text.strip()
     
@@ -159,120 +181,125 @@ def _findtext_multi(comp: ET.Element, xpaths: list[str]) -> Optional[str]:
     """
     Tenta múltiplos XPaths e retorna o primeiro resultado encontrado.
     """
+    # A varredura por nome local só depende do nome: cada um é varrido uma vez
+    scanned: set[str] = set()
     for xpath in xpaths:
-        result = _findtext(comp, xpath)
+        last_part = _compile_xpath(xpath)[2]
+        result = _findtext(comp, xpath, last_part not in scanned)
         if result:
             return result
+        scanned.add(last_part)
     return None
 
 
+# Campos de _extract_taxes: (chave, tag, pais no caminho ABRASF, conversor).
+# Ordem das chaves = ordem do dict de tributos.
+_TAX_FIELDS = (
+    ("iss_retido", "IssRetido", ("Servico", "Valores"), _to_int_boolflag),  # normalmente 1=sim, 2=não (depende do emissor)
+    ("base_calculo", "BaseCalculo", ("Servico", "Valores"), _to_float),
+    ("aliquota", "Aliquota", ("Servico", "Valores"), _to_float),
+    ("valor_iss", "ValorIss", ("Servico", "Valores"), _to_float),
+    ("valor_iss_retido", "ValorIssRetido", ("Servico", "Valores"), _to_float),
+    ("valor_deducoes", "ValorDeducoes", ("Servico", "Valores"), _to_float),
+    ("valor_pis", "ValorPis", ("Servico", "Valores"), _to_float),
+    ("valor_cofins", "ValorCofins", ("Servico", "Valores"), _to_float),
+    ("valor_inss", "ValorInss", ("Servico", "Valores"), _to_float),
+    ("valor_ir", "ValorIr", ("Servico", "Valores"), _to_float),
+    ("valor_csll", "ValorCsll", ("Servico", "Valores"), _to_float),
+    ("outras_retencoes", "OutrasRetencoes", ("Servico", "Valores"), _to_float),
+    ("desconto_incondicionado", "DescontoIncondicionado", ("Servico", "Valores"), _to_float),
+    ("desconto_condicionado", "DescontoCondicionado", ("Servico", "Valores"), _to_float),
+    # Em alguns emissores o valor líquido aparece aqui:
+    ("valor_liquido_nfse", "ValorLiquidoNfse", ("InfNfse",), _to_float),
+)
+
+_TAX_BY_TAG = {tag: (key, parents) for key, tag, parents, _ in _TAX_FIELDS}
+
+
+def _path_order(entry: tuple, parents: Tuple[str, ...], prefix: str) -> Optional[Tuple[int, int]]:
+    """
+    Posição do elemento na ordem do ElementPath para ".//P1/P2/tag", ou None
+    se os pais não casarem. entry = (elemento, ordem no documento, entry do pai).
+    """
+    anc = entry
+    for name in reversed(parents):
+        anc = anc[2]
+        if anc is None or anc[0].tag != prefix + name:
+            return None
+    # ".//" só casa descendentes: o primeiro pai não pode ser o próprio comp
+    if anc[2] is None:
+        return None
+    return anc[1], entry[1]
+
+
+def _scan_tax_texts(comp: ET.Element) -> Dict[str, Optional[str]]:
+    """
+    Texto de cada campo de _TAX_FIELDS numa única passada pela subárvore.
+
+    Mesmo resultado de _findtext_multi com [".//nfse:P/nfse:tag",
+    ".//nfse:tag", ".//tag"], nesta ordem:
+      1) primeira ocorrência do caminho com namespace (texto, se não vazio);
+      2) o mesmo caminho sem namespace;
+      3) primeiro elemento com esse nome local e texto não vazio.
+    As tentativas seguintes só devolveriam texto em branco, que os
+    conversores já tratam como None.
+    """
+    ns_hits: Dict[str, Tuple[Tuple[int, int], Optional[str]]] = {}
+    plain_hits: Dict[str, Tuple[Tuple[int, int], Optional[str]]] = {}
+    by_local: Dict[str, str] = {}
+
+    order = 0
+    stack: List[Tuple[ET.Element, Optional[tuple]]] = [(comp, None)]
+    while stack:
+        el, parent = stack.pop()
+        entry = (el, order, parent)
+        order += 1
+
+        tag = el.tag
+        local = tag.rpartition("}")[2]
+        field = _TAX_BY_TAG.get(local)
+        if field is not None:
+            key, parents = field
+            text = el.text
+            if key not in by_local and text and text.strip():
+                by_local[key] = text.strip()
+
+            if tag == local:
+                hits, prefix = plain_hits, ""
+            elif tag == _NFSE_PREFIX + local:
+                hits, prefix = ns_hits, _NFSE_PREFIX
+            else:
+                hits = None
+            if hits is not None:
+                pos = _path_order(entry, parents, prefix)
+                if pos is not None and (key not in hits or pos < hits[key][0]):
+                    hits[key] = (pos, text)
+
+        if len(el):
+            stack.extend((child, entry) for child in reversed(el))
+
+    texts: Dict[str, Optional[str]] = {}
+    for key, _, _, _ in _TAX_FIELDS:
+        text = None
+        for hits in (ns_hits, plain_hits):
+            hit = hits.get(key)
+            if hit is not None and hit[1]:
+                text = hit[1]
+                break
+        texts[key] = text or by_local.get(key)
+    return texts
+
+
 def _extract_taxes(comp: ET.Element) -> Dict[str, Any]:
     """
     Extrai tributos do XML ABRASF.
     Mantém tudo opcional: se não existir no emissor, retorna None nos campos.
+
+    Uma passada pela subárvore (ver _scan_tax_texts) em vez de uma cadeia
+    de findtext por campo.
     """
-    # Em alguns emissores o valor líquido aparece aqui:
-    valor_liquido_nfse = _to_float(_findtext_multi(comp, [
-        ".//nfse:InfNfse/nfse:ValorLiquidoNfse",
-        ".//nfse:ValorLiquidoNfse",
-        ".//ValorLiquidoNfse"
-    ]))
-
-    # Servico/Valores (ABRASF) - usando fallbacks robustos
-    iss_retido = _to_int_boolflag(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:IssRetido",
-        ".//nfse:Valores/nfse:IssRetido",
-        ".//IssRetido"
-    ]))
-
-    base_calculo = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:BaseCalculo",
-        ".//nfse:Valores/nfse:BaseCalculo",
-        ".//BaseCalculo"
-    ]))
-    aliquota = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:Aliquota",
-        ".//nfse:Valores/nfse:Aliquota",
-        ".//Aliquota"
-    ]))
-
-    valor_iss = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorIss",
-        ".//nfse:Valores/nfse:ValorIss",
-        ".//ValorIss"
-    ]))
-    valor_iss_retido = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorIssRetido",
-        ".//nfse:Valores/nfse:ValorIssRetido",
-        ".//ValorIssRetido"
-    ]))
-
-    valor_deducoes = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorDeducoes",
-        ".//nfse:Valores/nfse:ValorDeducoes",
-        ".//ValorDeducoes"
-    ]))
-
-    valor_pis = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorPis",
-        ".//nfse:Valores/nfse:ValorPis",
-        ".//ValorPis"
-    ]))
-    valor_cofins = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorCofins",
-        ".//nfse:Valores/nfse:ValorCofins",
-        ".//ValorCofins"
-    ]))
-    valor_inss = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorInss",
-        ".//nfse:Valores/nfse:ValorInss",
-        ".//ValorInss"
-    ]))
-    valor_ir = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorIr",
-        ".//nfse:Valores/nfse:ValorIr",
-        ".//ValorIr"
-    ]))
-    valor_csll = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:ValorCsll",
-        ".//nfse:Valores/nfse:ValorCsll",
-        ".//ValorCsll"
-    ]))
-
-    outras_retencoes = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:OutrasRetencoes",
-        ".//nfse:Valores/nfse:OutrasRetencoes",
-        ".//OutrasRetencoes"
-    ]))
-    desconto_incondicionado = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:DescontoIncondicionado",
-        ".//nfse:Valores/nfse:DescontoIncondicionado",
-        ".//DescontoIncondicionado"
-    ]))
-    desconto_condicionado = _to_float(_findtext_multi(comp, [
-        ".//nfse:Servico/nfse:Valores/nfse:DescontoCondicionado",
-        ".//nfse:Valores/nfse:DescontoCondicionado",
-        ".//DescontoCondicionado"
-    ]))
-
-    taxes = {
-        "iss_retido": iss_retido,  # normalmente 1=sim, 2=não (depende do emissor)
-        "base_calculo": base_calculo,
-        "aliquota": aliquota,
-        "valor_iss": valor_iss,
-        "valor_iss_retido": valor_iss_retido,
-        "valor_deducoes": valor_deducoes,
-        "valor_pis": valor_pis,
-        "valor_cofins": valor_cofins,
-        "valor_inss": valor_inss,
-        "valor_ir": valor_ir,
-        "valor_csll": valor_csll,
-        "outras_retencoes": outras_retencoes,
-        "desconto_incondicionado": desconto_incondicionado,
-        "desconto_condicionado": desconto_condicionado,
-        "valor_liquido_nfse": valor_liquido_nfse,
-    }
-    return taxes
+    texts = _scan_tax_texts(comp)
+    return {key: convert(texts[key]) for key, _, _, convert in _TAX_FIELDS}
 
 def _calc_valor_liquido_politica_b(valor_servicos: Optional[float], taxes: Dict[str, Any]) -> Optional[float]:
     """
@@ -311,10 +338,24 @@ def _calc_valor_liquido_politica_b(valor_servicos: Optional[float], taxes: Dict[
     return round(liquido, 2)
 
 def _normalize_cnae(raw: Optional[str]) -> Optional[str]:
-    if not raw:
-        return None
-    digits = re.sub(r"\D+", "", str(raw))
-    return digits or None
+    return digits_only_or_none(raw)
+
+
+# Candidatos de CNAE em ordem de preferência (montados uma vez)
+_CNAE_XPATHS_NS = (
+    ".//nfse:Servico/nfse:CodigoCnae",
+    ".//nfse:Servico/nfse:CodigoCNAE",
+    ".//nfse:Servico/nfse:Cnae",
+    ".//nfse:Servico/nfse:CNAE",
+    ".//nfse:CodigoCnae",
+    ".//nfse:CodigoCNAE",
+    ".//nfse:Cnae",
+    ".//nfse:CNAE",
+)
+_CNAE_XPATHS_NO_NS = tuple(
+    (xp.replace("nfse:", ""), xp.rsplit(":", 1)[-1]) for xp in _CNAE_XPATHS_NS
+)
+_CNAE_LOCAL_NAMES = ("CodigoCnae", "CodigoCNAE", "Cnae", "CNAE")
 
 
 def _extract_cnae_from_comp(comp: ET.Element) -> Optional[str]:
@@ -325,43 +366,37 @@ def _extract_cnae_from_comp(comp: ET.Element) -> Optional[str]:
       - sem namespace (<CodigoCnae>)
       - variações comuns (CodigoCNAE, Cnae, CNAE)
     """
+    # Nomes locais já varridos pela tentativa 3 de _findtext sem achar texto:
+    # nenhum elemento com esse nome tem texto, então os fallbacks abaixo
+    # podem pulá-los
+    scanned: set[str] = set()
+
     # 1) Tentativa direta com namespace (ABRASF)
-    candidates_ns = [
-        ".//nfse:Servico/nfse:CodigoCnae",
-        ".//nfse:Servico/nfse:CodigoCNAE",
-        ".//nfse:Servico/nfse:Cnae",
-        ".//nfse:Servico/nfse:CNAE",
-        ".//nfse:CodigoCnae",
-        ".//nfse:CodigoCNAE",
-        ".//nfse:Cnae",
-        ".//nfse:CNAE",
-    ]
-    for xp in candidates_ns:
-        val = _findtext(comp, xp)  # usa ABRASF_NS internamente
-        if val and val.strip():
-            return _normalize_cnae(val)
+    for xp in _CNAE_XPATHS_NS:
+        last_part = _compile_xpath(xp)[2]
+        val = _findtext(comp, xp, last_part not in scanned)  # usa ABRASF_NS internamente
+        if val:
+            if val.strip():
+                return _normalize_cnae(val)
+        else:
+            scanned.add(last_part)
 
     # 2) Fallback sem namespace (seu caso: <CodigoCnae>8610101</CodigoCnae>)
-    candidates_no_ns = [
-        ".//Servico/CodigoCnae",
-        ".//Servico/CodigoCNAE",
-        ".//Servico/Cnae",
-        ".//Servico/CNAE",
-        ".//CodigoCnae",
-        ".//CodigoCNAE",
-        ".//Cnae",
-        ".//CNAE",
-    ]
-    for xp in candidates_no_ns:
+    for xp, last_part in _CNAE_XPATHS_NO_NS:
+        if last_part in scanned:
+            continue
         node = comp.find(xp)
         if node is not None and (node.text or "").strip():
             return _normalize_cnae(node.text)
 
     # 3) Fallback final: varrer por "local-name" (pega mesmo se houver namespace diferente)
+    local_names = tuple(n for n in _CNAE_LOCAL_NAMES if n not in scanned)
+    if not local_names:
+        return None
     for el in comp.iter():
         tag = el.tag
         local = tag.split("}", 1)[-1] if "}" in tag else tag
-        if local in ("CodigoCnae", "CodigoCNAE", "Cnae", "CNAE"):
+        if local in local_names:
             txt = (el.text or "").strip()
             if txt:
                 return _normalize_cnae(txt)
@@ -369,8 +404,6 @@ def _extract_cnae_from_comp(comp: ET.Element) -> Optional[str]:
     return None
 
 
-
-
 def _parse_all_items_from_xml(xml_bytes: bytes) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
     """
     Parse completo do XML.
@@ -34,6 +34,14 @@ def safe_float(value: Any) -> Optional[float]:
     if value is None:
         return None
     
+    # Caminho rápido: XML traz decimal com ponto ("12.50"); float() já
+    # ignora espaços nas pontas
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    
     try:
         if isinstance(value, (int, float)):
             return float(value)
@@ -62,6 +70,13 @@ def safe_int(value: Any) -> Optional[int]:
     if value is None:
         return None
     
+    # Caminho rápido para texto do XML (float() já ignora espaços nas pontas)
+    if isinstance(value, str):
+        try:
+            return int(float(value))  # Permite "123.0" -> 123
+        except ValueError:
+            return None
+    
     try:
         if isinstance(value, int):
             return value
@@ -75,6 +90,12 @@ def safe_int(value: Any) -> Optional[int]:
         return None
 
 
+_NON_DIGITS_RE = re.compile(r"\D+")
+
+# Remove todo caractere ASCII que não é dígito (str.translate, laço em C)
+_ASCII_NON_DIGITS = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+
 def digits_only(value: Optional[str]) -> str:
     """
     Remove todos os caracteres não-numéricos de uma string.
@@ -87,7 +108,13 @@ def digits_only(value: Optional[str]) -> str:
     """
     if not value:
         return ""
-    return re.sub(r"\D+", "", str(value))
+    s = str(value)
+    if s.isdecimal():
+        return s
+    # CNPJ/CPF/chave são ASCII; fora disso o regex cobre dígitos Unicode (\d)
+    if s.isascii():
+        return s.translate(_ASCII_NON_DIGITS)
+    return _NON_DIGITS_RE.sub("", s)
 
 
 def digits_only_or_none(value: Optional[str]) -> Optional[str]:
@@ -129,6 +156,9 @@ def normalize_text_or_none(value: Any) -> Optional[str]:
     Returns:
         String normalizada ou None se vazia
     """
+    # Caminho rápido: texto de XML já é str (sem passar por normalize_text)
+    if type(value) is str:
+        return value.strip() or None
     result = normalize_text(value)
     return result if result else None
 
@@ -0,0 +1,90 @@
+# app/utils/process_pool.py
+"""
+Pool compartilhado para o processamento paralelo dos lotes (NF-e e NFS-e).
+
+Centraliza o que antes era copiado em cada serviço de lote:
+- criação sob demanda, um pool por processo;
+- workers iniciados por "forkserver" (ou "spawn"), nunca por fork direto;
+- descarte do pool quebrado, para ser recriado na próxima chamada.
+
+Os lotes rodam dentro de um worker do threadpool do servidor: um fork nesse
+ponto copiaria locks que outra thread pode estar segurando (caches, handlers
+de logging, estado interno do lxml) e o filho poderia travar.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger("doc_api")
+
+# Python free-threaded (3.13t+, GIL desligado): threads escalam sem o custo
+# de pickle/IPC do pool de processos
+_GIL_DISABLED = not getattr(sys, "_is_gil_enabled", lambda: True)()
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _mp_context() -> multiprocessing.context.BaseContext:
+    """Contexto de início dos workers: forkserver quando disponível, senão spawn."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def get_executor() -> Executor:
+    """Pool compartilhado (threads sem GIL, processos com GIL), criado sob demanda."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if _GIL_DISABLED:
+                _executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+            else:
+                _executor = ProcessPoolExecutor(
+                    max_workers=os.cpu_count(),
+                    mp_context=_mp_context(),
+                )
+        return _executor
+
+
+def _discard_executor(executor: Executor) -> None:
+    """Descarta o pool quebrado (se ainda for o atual); o próximo uso cria outro."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def map_in_pool(fn: Callable[..., Any], *iterables: Iterable[Any]) -> Optional[List[Any]]:
+    """
+    Executa fn no pool compartilhado, preservando a ordem dos resultados.
+
+    fn precisa ser top-level (é enviada por pickle aos workers) e tratar os
+    próprios erros por item.
+
+    Returns:
+        Lista de resultados, ou None se o pool não puder ser usado (o
+        chamador segue sequencial). Pool quebrado é registrado em log e
+        descartado.
+    """
+    try:
+        executor = get_executor()
+    except OSError as exc:
+        # Ambiente sem suporte a multiprocessing (ex.: sem semáforos POSIX)
+        logger.warning("Pool de processos indisponível | err=%s", exc)
+        return None
+
+    try:
+        return list(executor.map(fn, *iterables))
+    except BrokenProcessPool as exc:
+        logger.warning("Pool de processos quebrado; será recriado | err=%s", exc)
+        _discard_executor(executor)
+        return None
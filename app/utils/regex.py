@@ -1,6 +1,19 @@
 import re
-from typing import Optional
+from typing import Optional, Union
 
-def find_regex(pattern: str, source_text: str) -> Optional[str]:
-    m = re.search(pattern, source_text, re.IGNORECASE | re.MULTILINE)
+# Flags padrão das buscas por âncora em texto de nota
+REGEX_FLAGS = re.IGNORECASE | re.MULTILINE
+
+
+def compile_regex(pattern: str) -> "re.Pattern[str]":
+    """Pré-compila um padrão com as mesmas flags de find_regex."""
+    return re.compile(pattern, REGEX_FLAGS)
+
+
+def find_regex(pattern: Union[str, "re.Pattern[str]"], source_text: str) -> Optional[str]:
+    if isinstance(pattern, str):
+        m = re.search(pattern, source_text, REGEX_FLAGS)
+    else:
+        # Padrão já compilado (ver compile_regex): flags vêm dele
+        m = pattern.search(source_text)
     return m.group(1).strip() if m else None